@@ -0,0 +1,99 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, select
+from . import models
+from .index import split_taxonomy
+
+# Columns /taxonomy/rollup can group by
+GROUP_COLUMNS = {
+    "location": models.Sample.location,
+    "user_id": models.Sample.user_id,
+}
+
+
+def rollup_statement(group_by: Optional[str] = None, user_id: Optional[int] = None,
+                     location: Optional[str] = None):
+    """
+    Sample count and summed abundance per distinct taxonomy string (and group).
+    Taxonomies repeat a lot, so this is far smaller than the rows themselves.
+    """
+    group_column = GROUP_COLUMNS[group_by] if group_by else None
+    columns = [models.Sample.taxonomy]
+    if group_column is not None:
+        columns.append(group_column)
+    statement = select(*columns, func.count(models.Sample.id), func.sum(models.Sample.abundance))
+    if user_id is not None:
+        statement = statement.where(models.Sample.user_id == user_id)
+    if location is not None:
+        statement = statement.where(models.Sample.location == location)
+    return statement.group_by(*columns)
+
+
+def children_statement(path: str = ""):
+    """
+    Sample count per distinct rank directly below an exact taxonomy path, with
+    one taxonomy string spelling it. The lineage rank columns do the grouping;
+    below the deepest one it falls back to one row per distinct string.
+    """
+    parts = split_taxonomy(path) if path else []
+    ranks = [getattr(models.Lineage, rank) for rank in models.LINEAGE_RANKS]
+    statement = (select(func.min(models.Lineage.taxonomy), func.count(models.Sample.id))
+                 .join(models.Sample, models.Sample.lineage_id == models.Lineage.id)
+                 .where(*(rank == part for rank, part in zip(ranks, parts))))
+    if len(parts) < len(ranks):
+        return statement.where(ranks[len(parts)].is_not(None)).group_by(ranks[len(parts)])
+    return statement.group_by(models.Lineage.taxonomy)
+
+
+def children(rows: Iterable[Tuple[str, int]], path: str = "") -> List[Tuple[str, int]]:
+    """
+    Fold (taxonomy, count) rows of children_statement into (rank, samples)
+    pairs, most samples first; each rank keeps the spelling of its row
+    """
+    parts = split_taxonomy(path) if path else []
+    depth = len(parts)
+    totals: Dict[str, list] = {}  # Normalized rank -> [label, samples]
+    for taxonomy, count in rows:
+        ranks = split_taxonomy(taxonomy)
+        if len(ranks) <= depth or ranks[:depth] != parts:
+            continue  # Only past the rank columns: shorter or off the path
+        entry = totals.get(ranks[depth])
+        if entry is None:
+            entry = totals[ranks[depth]] = [taxonomy.split(';')[depth].strip(), 0]
+        entry[1] += count
+    return sorted(((label, count) for label, count in totals.values()), key=lambda item: (-item[1], item[0]))
+
+
+def rollup(rows: Iterable[Tuple], depth: int, grouped: bool = False) -> List[Dict]:
+    """
+    Fold (taxonomy, [group,] count, abundance sum) rows up to the first `depth`
+    ranks in one pass. Ranks compare like the lineage rank columns (trimmed,
+    case-insensitive) and keep the spelling seen first; shorter taxonomies stay
+    at their own depth.
+    """
+    totals: Dict[tuple, list] = {}  # (group, ranks) -> [label, samples, abundance sum]
+    for row in rows:
+        if grouped:
+            taxonomy, group, count, total = row
+        else:
+            (taxonomy, count, total), group = row, None
+        parts = [part.strip() for part in taxonomy.split(';')][:depth]
+        key = (group, tuple(split_taxonomy(taxonomy)[:depth]))
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = [";".join(parts), 0, 0.0]
+        entry[1] += count
+        entry[2] += total or 0.0
+
+    result = [
+        {
+            "taxonomy": label,
+            "group": group,
+            "samples": count,
+            "total_abundance": total,
+            "mean_abundance": total / count,
+        }
+        for (group, _), (label, count, total) in totals.items()
+    ]
+    # Largest totals first within each group
+    result.sort(key=lambda r: (str(r["group"]), -r["total_abundance"]))
+    return result
\ No newline at end of file
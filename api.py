@@ -1,142 +1,661 @@
-from fastapi import FastAPI, Depends, HTTPException
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from .database import SessionLocal, engine
-from . import models, auth, schemas
+from itertools import islice
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from .database import AsyncSessionLocal, SessionLocal, async_engine, begin_write, engine
+from . import models, auth, schemas, ingest, metrics, aggregate, lineage, batch, diversity, export, fulltext
+from .cache import GLOBAL_VERSION, data_versions, search_cache
+from .columnar import columnar_snapshot
+from .index import trigram_index
+from .shards import sharded_search
 from .strategy import (
     SearchContext, 
+    SearchStrategy,
     ExactMatchStrategy, 
     ApproximateMatchStrategy, 
     HierarchicalMatchStrategy,
-    AbundanceFilterStrategy
+    AbundanceFilterStrategy,
+    FullTextStrategy
 )
 
 models.Base.metadata.create_all(bind=engine)
+lineage.migrate(engine)  # Link samples stored before the lineage table existed
+with SessionLocal() as _db:
+    diversity.backfill_alpha(_db)  # Summaries for samples stored before they were kept
+    data_versions.setup(_db)  # Version counters for databases created before they existed
+fulltext.setup(engine)  # FTS5 index for the "fulltext" strategy (SQLite only)
 
 app = FastAPI()
+# Compress responses above this many bytes for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MINIMUM_SIZE", "1000")))
 
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
 
-def get_db():
-    """Dependency Injection - FastAPI's built-in pattern"""
-    db = SessionLocal()
+STREAM_BATCH_SIZE = 1000
+# CPU-bound strategies that /search spreads over the shard workers when SEARCH_SHARDS is set
+# ("hierarchical" is answered faster by the lineage rank columns than by scanning shards)
+SHARDED_STRATEGIES = ("approximate",)
+
+# Threads for CPU-bound search work, keeping it off the event loop
+search_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SEARCH_WORKERS", "4")), thread_name_prefix="search")
+
+
+@app.middleware("http")
+async def record_timing(request: Request, call_next):
+    """Per-route latency histogram; with an X-Profile header, a Server-Timing breakdown"""
+    token = metrics.start_profile(bool(request.headers.get("X-Profile")))
+    started = time.perf_counter()
     try:
-        yield db
+        response = await call_next(request)
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_DURATION.observe(
+            elapsed, method=request.method, route=route.path if route else "unmatched",
+            status=response.status_code)
+        profile = metrics.current_profile()
+        if profile is not None:
+            response.headers["Server-Timing"] = metrics.server_timing(profile, elapsed)
+        return response
     finally:
-        db.close()
+        metrics.end_profile(token)
+
+
+@app.middleware("http")
+async def set_etag(request: Request, call_next):
+    """Label successful reads with the ETag their conditional_get() computed"""
+    response = await call_next(request)
+    etag = getattr(request.state, "etag", None)
+    if etag is not None and response.status_code == 200:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"  # Reuse only after revalidating
+    return response
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison, as If-None-Match calls for
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Dependency Injection - FastAPI's built-in pattern"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def conditional_get(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Dependency for read endpoints: an ETag from the data version (the user's
+    when the request is limited to one `user_id`, the global one otherwise),
+    read from the database so writes through any worker process change it.
+    A matching If-None-Match answers 304 after that single-row lookup.
+    """
+    user_id = request.path_params.get("user_id", request.query_params.get("user_id"))
+    try:
+        user_id = int(user_id) if user_id is not None else None
+    except ValueError:
+        user_id = None
+    # Read before the data is, so a write racing the request can only make the tag stale
+    if user_id is None:
+        version = global_version = await db.scalar(data_versions.query()) or 0
+    else:
+        versions = dict((await db.execute(data_versions.query_with_global(user_id))).all())
+        version, global_version = versions.get(user_id, 0), versions.get(GLOBAL_VERSION, 0)
+    etag = data_versions.etag(version, f"{request.url.path}?{request.url.query}")
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+    request.state.etag = etag
+    request.state.data_version = global_version  # What the in-memory indexes and the search cache follow
+
+
+def _load_index(index, version: int):
+    with SessionLocal() as db:
+        index.load(db, version)
+
+
+async def _ensure_current(index, version: int):
+    """
+    Build an in-memory index on first use, in a worker thread, and again
+    whenever it misses writes up to the global data `version` (writes made
+    through other worker processes)
+    """
+    if not index.current(version):
+        await run_in_threadpool(_load_index, index, version)
+
+
+async def _get_user(db: AsyncSession, user_id: int) -> models.User:
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+async def current_user_id(
+    user_id: Optional[int] = None,
+    authorization: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+) -> int:
+    """
+    Dependency for write endpoints: the acting user. A session token from
+    /login (`Authorization: Bearer ...`) is checked in memory; a bare
+    `user_id` parameter is only accepted for older clients when
+    ALLOW_USER_ID_AUTH is set, and is then looked up in the database.
+    """
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        token_user_id = auth.verify_token(token.strip()) if scheme.lower() == "bearer" else None
+        if token_user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired session token",
+                                headers={"WWW-Authenticate": "Bearer"})
+        if user_id is not None and user_id != token_user_id:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        return token_user_id
+    if user_id is None or not auth.ALLOW_USER_ID_AUTH:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    await _get_user(db, user_id)
+    return user_id
+
+
+def _samples_added(samples: Iterable[Tuple[int, int, float, str]], version: int):
+    """
+    Keep the in-memory indexes current after (id, user_id, abundance, taxonomy)
+    rows were committed, bumping the global data version to `version`
+    """
+    for sample_id, user_id, abundance, taxonomy in samples:
+        trigram_index.add(sample_id, taxonomy)
+        columnar_snapshot.add(sample_id, user_id, abundance, taxonomy)
+        sharded_search.add(sample_id, user_id, abundance, taxonomy)
+    trigram_index.written(version)
+    columnar_snapshot.written(version)
+    sharded_search.written(version)
+    search_cache.invalidate()
+
+
+def _samples_removed(samples: Iterable[Tuple[int, int]], version: int):
+    """Drop deleted (id, user_id) samples from the in-memory indexes"""
+    for sample_id, _ in samples:
+        trigram_index.remove(sample_id)
+        columnar_snapshot.remove(sample_id)
+        sharded_search.remove(sample_id)
+    trigram_index.written(version)
+    columnar_snapshot.written(version)
+    sharded_search.written(version)
+    search_cache.invalidate()
+
+
+def _paginate(sample_query, limit: Optional[int], after: Optional[int]):
+    """Keyset pagination on Sample.id: rows after the cursor, in id order"""
+    sample_query = sample_query.order_by(models.Sample.id)
+    if after is not None:
+        sample_query = sample_query.filter(models.Sample.id > after)
+    if limit is not None:
+        sample_query = sample_query.limit(limit)
+    return sample_query
+
+
+def _set_next_cursor(response: Response, results: list, limit: Optional[int]):
+    # A full page means there may be more; point the client at the next one
+    if limit is not None and len(results) == limit:
+        response.headers["X-Next-Cursor"] = str(results[-1].id)
+
+
+def _check_output(output: str):
+    if output not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Invalid format: {output}. Valid options: json, ndjson")
+
+
+def _ndjson_response(fetch: Callable[[Session], Iterable[models.Sample]]) -> StreamingResponse:
+    """
+    Stream samples as newline-delimited JSON. The rows are read on a session
+    owned by the stream, which stays open until the last line is sent.
+    """
+    def lines():
+        db = SessionLocal()
+        try:
+            chunk = []
+            for sample in fetch(db):
+                chunk.append(schemas.SampleOut.model_validate(sample).model_dump_json())
+                if len(chunk) >= STREAM_BATCH_SIZE:
+                    yield "\n".join(chunk) + "\n"
+                    chunk = []
+            if chunk:
+                yield "\n".join(chunk) + "\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def _select_strategy(strategy: str, min_abundance: float, max_abundance: float,
+                           threshold: float, limit: Optional[int], version: int,
+                           indexed: bool = True) -> SearchStrategy:
+    """
+    The SearchStrategy named by a request, with any index it uses current up
+    to the global data `version` (none with indexed=False, for strategies sent
+    to the shard workers). Hierarchical queries always run against the
+    lineage rank columns.
+    """
+    if strategy == "exact":
+        return ExactMatchStrategy()
+    elif strategy == "approximate":
+        if not indexed:
+            return ApproximateMatchStrategy(threshold, limit)
+        await _ensure_current(trigram_index, version)
+        return ApproximateMatchStrategy(threshold, limit, trigram_index)
+    elif strategy == "hierarchical":
+        return HierarchicalMatchStrategy()
+    elif strategy == "abundance":
+        return AbundanceFilterStrategy(min_abundance, max_abundance)
+    elif strategy == "fulltext":
+        if not fulltext.available:
+            raise HTTPException(status_code=400, detail="Strategy 'fulltext' needs a SQLite database with FTS5")
+        return FullTextStrategy()
+    raise HTTPException(status_code=400, detail=f"Invalid strategy: {strategy}. Valid options: exact, approximate, hierarchical, abundance, fulltext")
+
+
+def _export_response(fetch: Callable[[Session], Iterable], output: str) -> StreamingResponse:
+    """Stream rows as an export file, read on a session owned by the stream"""
+    media_type, extension = export.FORMATS[output]
+    
+    def chunks():
+        db = SessionLocal()
+        try:
+            yield from export.encode(fetch(db), output)
+        finally:
+            db.close()
+    
+    return StreamingResponse(chunks(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="samples.{extension}"'})
+
+
+def _ingest_table(user_id: int, file: UploadFile, file_format: Optional[str], location: Optional[str]):
+    """Parse an uploaded table and bulk insert it on a session of its own"""
+    if file_format == "tsv":
+        rows = ingest.read_delimited(file.file, "\t")
+    elif file_format == "csv":
+        rows = ingest.read_delimited(file.file, ",")
+    elif file_format == "biom":
+        try:
+            rows = ingest.read_biom(file.file, location)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid BIOM table: {e}")
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid format: {file_format}. Valid options: tsv, csv, biom")
+
+    with SessionLocal() as db:
+        return ingest.bulk_insert(db, user_id, rows, on_inserted=_samples_added)
 
 
 
 
 @app.post("/users/", response_model=schemas.UserOut)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    if db.query(models.User).filter(models.User.username == user.username).first():
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    if await db.scalar(select(models.User).where(models.User.username == user.username)):
         raise HTTPException(status_code=400, detail="Username already exists")
     
     salt = auth.generate_salt()
-    hashed_password = auth.hash_password(user.password, salt)
+    hashed_password = await run_in_threadpool(auth.hash_password, user.password, salt)
     
     db_user = models.User(username=user.username, hashed_password=hashed_password, salt=salt)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
+    db.add(models.DataVersion(user_id=db_user.id, version=data_versions.initial()))
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
 @app.post("/login")
-def login_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def login_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(models.User).where(models.User.username == user.username))
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    hashed_attempt = auth.hash_password(user.password, db_user.salt)
-
-    if hashed_attempt != db_user.hashed_password:
+    # Hashing runs on a worker thread so a burst of logins doesn't stall the event loop
+    if not await run_in_threadpool(auth.verify_password, user.password, db_user.salt, db_user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    return {"message": "Login successful", "user_id": db_user.id, "username": user.username}
+    return {"message": "Login successful", "user_id": db_user.id, "username": user.username,
+            "token": auth.issue_token(db_user.id), "expires_in": auth.SESSION_TTL}
 
 
 
 
 @app.post("/samples/", response_model=schemas.SampleOut)
-def create_sample(sample: schemas.SampleCreate, user_id: int, db: Session = Depends(get_db)):
+async def create_sample(sample: schemas.SampleCreate, user_id: int = Depends(current_user_id),
+                        db: AsyncSession = Depends(get_db)):
     """Create a new microbiome sample"""
-    # Verify user exists
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+    await db.run_sync(begin_write)  # The alpha summaries are read and rewritten below
     # Create sample
+    lineage_ids = await db.run_sync(lineage.lineage_ids, [sample.taxonomy])
     db_sample = models.Sample(
         name=sample.name,
         taxonomy=sample.taxonomy,
         abundance=sample.abundance,
         location=sample.location,
-        user_id=user_id
+        user_id=user_id,
+        lineage_id=lineage_ids[sample.taxonomy]
     )
     db.add(db_sample)
-    db.commit()
-    db.refresh(db_sample)
+    await db.run_sync(diversity.update_alpha, [(db_sample.name, db_sample.location, user_id,
+                                                db_sample.lineage_id, db_sample.abundance)])
+    version = await db.run_sync(data_versions.bump, [user_id])
+    await db.commit()
+    await db.refresh(db_sample)
+    _samples_added([(db_sample.id, db_sample.user_id, db_sample.abundance, db_sample.taxonomy)], version)
     return db_sample
 
 
-@app.get("/samples/", response_model=List[schemas.SampleOut])
-def get_all_samples(db: Session = Depends(get_db)):
-    """Get all samples"""
-    return db.query(models.Sample).all()
+@app.post("/samples/bulk", response_model=schemas.BulkIngestOut)
+async def bulk_create_samples(
+    user_id: int = Depends(current_user_id),
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Query(None, alias="format"),  # "tsv", "csv" or "biom"; guessed from the file name if omitted
+    location: Optional[str] = None  # Default location for BIOM columns without one
+):
+    """Load a TSV/CSV or BIOM-style abundance table in chunked bulk inserts"""
+    file_format = file_format or ingest.detect_format(file.filename)
+    # Parsing and inserting is long-running blocking work, done on a worker thread
+    return await run_in_threadpool(_ingest_table, user_id, file, file_format, location)
 
 
-@app.get("/samples/user/{user_id}", response_model=List[schemas.SampleOut])
-def get_user_samples(user_id: int, db: Session = Depends(get_db)):
-    """Get all samples for a specific user"""
-    return db.query(models.Sample).filter(models.Sample.user_id == user_id).all()
+@app.get("/samples/", response_model=List[schemas.SampleOut], dependencies=[Depends(conditional_get)])
+async def get_all_samples(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[int] = None,
+    output: str = Query("json", alias="format"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get all samples, optionally one page (limit/after) at a time or streamed as NDJSON"""
+    _check_output(output)
+    if output == "ndjson":
+        return _ndjson_response(
+            lambda s: _paginate(s.query(models.Sample), limit, after).yield_per(STREAM_BATCH_SIZE))
+    
+    results = (await db.scalars(_paginate(select(models.Sample), limit, after))).all()
+    _set_next_cursor(response, results, limit)
+    return results
+
+
+@app.get("/samples/export", dependencies=[Depends(conditional_get)])
+async def export_samples(
+    request: Request,
+    output: str = Query("csv", alias="format"),  # "csv", "parquet" or "arrow" (IPC stream)
+    user_id: Optional[int] = None,
+    strategy: Optional[str] = None,  # Any /search strategy, to export only its matches
+    query: str = "",
+    min_abundance: float = 0.0,
+    max_abundance: float = 100.0,
+    threshold: float = Query(0.6, ge=0.0, le=1.0)
+):
+    """Stream samples, or the matches of a search, as CSV, Parquet or Arrow record batches"""
+    if output not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format: {output}. Valid options: csv, parquet, arrow")
+    if not export.available(output):
+        raise HTTPException(status_code=501, detail=f"Exporting {output} needs pyarrow installed on the server")
+    search_strategy = None
+    if strategy is not None:
+        search_strategy = await _select_strategy(strategy, min_abundance, max_abundance, threshold, None,
+                                                 request.state.data_version)
+    
+    def rows(db: Session):
+        # Plain column tuples: no ORM objects to build for millions of rows
+        sample_query = db.query(*(getattr(models.Sample, column) for column in export.COLUMNS))
+        if user_id is not None:
+            sample_query = sample_query.filter(models.Sample.user_id == user_id)
+        if search_strategy is None or not search_strategy.ranked:
+            sample_query = sample_query.order_by(models.Sample.id)  # Ranked matches come best first instead
+        if search_strategy is None:
+            return sample_query.yield_per(export.BATCH_SIZE)
+        return SearchContext(search_strategy).stream_query(query, sample_query, export.BATCH_SIZE)
+    
+    return _export_response(rows, output)
+
+
+@app.get("/samples/user/{user_id}", response_model=List[schemas.SampleOut], dependencies=[Depends(conditional_get)])
+async def get_user_samples(
+    user_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[int] = None,
+    output: str = Query("json", alias="format"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get all samples for a specific user, optionally paged or streamed as NDJSON"""
+    _check_output(output)
+    
+    def user_samples(sample_query):
+        return _paginate(sample_query.filter(models.Sample.user_id == user_id), limit, after)
+    
+    if output == "ndjson":
+        return _ndjson_response(lambda s: user_samples(s.query(models.Sample)).yield_per(STREAM_BATCH_SIZE))
+    
+    results = (await db.scalars(user_samples(select(models.Sample)))).all()
+    _set_next_cursor(response, results, limit)
+    return results
 
 
 @app.delete("/samples/{sample_id}")
-def delete_sample(sample_id: int, user_id: int, db: Session = Depends(get_db)):
+async def delete_sample(sample_id: int, user_id: int = Depends(current_user_id),
+                        db: AsyncSession = Depends(get_db)):
     """Delete a sample"""
-    sample = db.query(models.Sample).filter(models.Sample.id == sample_id).first()
+    await db.run_sync(begin_write)  # Before reading the sample, so it can't be taken out twice
+    sample = await db.get(models.Sample, sample_id)
     if not sample:
         raise HTTPException(status_code=404, detail="Sample not found")
     if sample.user_id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    db.delete(sample)
-    db.commit()
+    await db.delete(sample)
+    await db.run_sync(diversity.update_alpha, [(sample.name, sample.location, sample.user_id,
+                                                sample.lineage_id, sample.abundance)], -1)
+    version = await db.run_sync(data_versions.bump, [sample.user_id])
+    await db.commit()
+    _samples_removed([(sample_id, sample.user_id)], version)
     return {"message": "Sample deleted successfully"}
 
 
 
 
-@app.get("/search", response_model=List[schemas.SampleOut])
-def search_samples(
+@app.get("/search", response_model=List[schemas.SampleOut], dependencies=[Depends(conditional_get)])
+async def search_samples(
+    request: Request,
+    response: Response,
     query: str,
-    strategy: str = "exact",  # Strategy selector: "exact", "approximate", "hierarchical", "abundance"
+    strategy: str = "exact",  # Strategy selector: "exact", "approximate", "hierarchical", "abundance", "fulltext"
     min_abundance: float = 0.0,
     max_abundance: float = 100.0,
-    db: Session = Depends(get_db)
+    threshold: float = Query(0.6, ge=0.0, le=1.0),  # Similarity threshold for "approximate"
+    limit: Optional[int] = Query(None, ge=1),  # Page size; best-N cap for "approximate"
+    after: Optional[int] = None,  # Keyset cursor (last sample id of the previous page)
+    output: str = Query("json", alias="format"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Unified search endpoint demonstrating Strategy Pattern.
     Strategy is selected at runtime based on the 'strategy' parameter.
     """
-    # Get all samples from database
-    samples = db.query(models.Sample).all()
+    _check_output(output)
     
     # Select strategy based on parameter
-    if strategy == "exact":
-        search_strategy = ExactMatchStrategy()
-    elif strategy == "approximate":
-        search_strategy = ApproximateMatchStrategy()
-    elif strategy == "hierarchical":
-        search_strategy = HierarchicalMatchStrategy()
-    elif strategy == "abundance":
-        search_strategy = AbundanceFilterStrategy(min_abundance, max_abundance)
-    else:
-        raise HTTPException(status_code=400, detail=f"Invalid strategy: {strategy}. Valid options: exact, approximate, hierarchical, abundance")
+    sharded = output == "json" and sharded_search.enabled and strategy in SHARDED_STRATEGIES
+    search_strategy = await _select_strategy(strategy, min_abundance, max_abundance, threshold, limit,
+                                             request.state.data_version, indexed=not sharded)
+    
+    # Ranked by similarity, so only the best `limit` can be asked for
+    if search_strategy.ranked and after is not None:
+        raise HTTPException(status_code=400, detail=f"Strategy '{strategy}' is ranked and does not support 'after'")
     
-    # Execute search using selected strategy
+    def candidates(sample_query):
+        return sample_query if search_strategy.ranked else _paginate(sample_query, None, after)
+    
+    # Execute search using selected strategy, filtering in SQL where the strategy allows it
     context = SearchContext(search_strategy)
-    results = context.execute_search(query, samples)
+    if output == "ndjson":
+        def matches(s: Session):
+            return islice(context.stream_query(query, candidates(s.query(models.Sample)), STREAM_BATCH_SIZE), limit)
+        return _ndjson_response(matches)
+    
+    # Keyed on the data version too, so writes through other workers aren't answered from this one's cache
+    cache_key = (strategy, query, min_abundance, max_abundance, threshold, limit, after, request.state.data_version)
+    results = search_cache.get(cache_key)
+    if results is None:
+        generation = search_cache.generation
+        if sharded:
+            # Every shard worker runs the strategy on its id range at once; fetch only the matches
+            await _ensure_current(sharded_search, request.state.data_version)
+            samples = await context.execute_sharded_async(
+                query, db, sharded_search, after, limit, search_executor)
+        elif columnar_snapshot.enabled and not search_strategy.ranked:
+            # Decide the matches with masks over the in-memory columns, fetch only those rows
+            await _ensure_current(columnar_snapshot, request.state.data_version)
+            samples = await context.execute_snapshot_async(
+                query, db, columnar_snapshot, after, limit, search_executor)
+        else:
+            samples = await context.execute_query_async(
+                query, db, candidates(select(models.Sample)), limit, search_executor)
+        with metrics.timed(search_strategy.name, "serialize"):
+            results = [schemas.SampleOut.model_validate(s) for s in samples]
+        search_cache.put(cache_key, results, generation)
+    if not search_strategy.ranked:
+        _set_next_cursor(response, results, limit)
+    
+    return results
+
+
+@app.post("/search/batch", response_model=Dict[str, List[schemas.SampleOut]])
+async def batch_search_samples(request: schemas.BatchSearchIn, db: AsyncSession = Depends(get_db)):
+    """Run many searches against one read of the samples; results keyed by query (or `key`)"""
+    keys = [item.key if item.key is not None else item.query for item in request.queries]
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=400, detail="Duplicate query keys; set 'key' to tell them apart")
+    for item in request.queries:
+        if item.strategy not in batch.STRATEGIES:
+            raise HTTPException(status_code=400, detail=f"Invalid strategy: {item.strategy}. Valid options: {', '.join(batch.STRATEGIES)}")
+    
+    if any(item.strategy == "approximate" for item in request.queries):
+        await _ensure_current(trigram_index, await db.scalar(data_versions.query()) or 0)
+    
+    def run():
+        with SessionLocal() as db:
+            results = batch.batch_search(db, request.queries, trigram_index)
+            return {key: [schemas.SampleOut.model_validate(s) for s in samples]
+                    for key, samples in zip(keys, results)}
+    
+    # One long scan and CPU-bound matching: keep it off the event loop
+    return await run_in_threadpool(run)
+
+
+@app.get("/diversity/alpha", response_model=List[schemas.AlphaDiversityOut], dependencies=[Depends(conditional_get)])
+async def get_alpha_diversity(
+    group_by: str = "location",  # "location", "name" or "user_id"
+    group: Optional[str] = None,  # One group only
+    db: AsyncSession = Depends(get_db)
+):
+    """Richness, Shannon and Simpson per sample group, read from the maintained summaries"""
+    if group_by not in models.DIVERSITY_GROUPS:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {group_by}. Valid options: location, name, user_id")
+    
+    statement = select(models.GroupDiversity).where(models.GroupDiversity.kind == group_by)
+    if group is not None:
+        statement = statement.where(models.GroupDiversity.value == group)
+    summaries = await db.scalars(statement.order_by(models.GroupDiversity.value))
+    return [diversity.alpha_metrics(summary) for summary in summaries]
+
+
+@app.get("/diversity/beta", dependencies=[Depends(conditional_get)])
+async def get_beta_diversity(
+    metric: str = "braycurtis",  # "braycurtis" or "jaccard"
+    group_by: str = "location",  # Samples are pooled per "location" or per "name"
+    user_id: Optional[int] = None
+):
+    """Pairwise distances between sample groups, streamed as a labelled TSV matrix"""
+    if metric not in diversity.METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid metric: {metric}. Valid options: braycurtis, jaccard")
+    if group_by not in diversity.GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {group_by}. Valid options: location, name")
+    if diversity.np is None:
+        raise HTTPException(status_code=501, detail="Beta diversity needs numpy installed on the server")
+    
+    def compute():
+        # The matrix goes to a memory-mapped file, read back while streaming
+        directory = tempfile.mkdtemp(prefix="beta-diversity-")
+        try:
+            with SessionLocal() as db:
+                matrix = diversity.abundance_matrix(db, group_by, user_id)
+            return matrix.labels, diversity.distance_matrix(matrix, metric, directory), directory
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+    
+    labels, distances, directory = await run_in_threadpool(compute)
+    
+    def lines():
+        try:
+            yield from diversity.tsv_lines(labels, distances)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    
+    return StreamingResponse(lines(), media_type="text/tab-separated-values")
+
+
+@app.get("/health")
+async def health(db: AsyncSession = Depends(get_db)):
+    """Cheap liveness check; the data version lets clients key their caches"""
+    return {"status": "ok", "data_version": str(await db.scalar(data_versions.query()) or 0)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request, search, SQL and cache metrics"""
+    stats = search_cache.stats()
+    cache_lines = metrics.render_values(
+        "search_cache_events_total", "counter", "Search result cache events",
+        {kind: stats[kind] for kind in ("hits", "misses", "evictions", "expired")})
+    cache_lines += metrics.render_values(
+        "search_cache_entries", "gauge", "Search result cache occupancy",
+        {"size": stats["size"], "maxsize": stats["maxsize"]})
+    return PlainTextResponse(metrics.render(cache_lines), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/search/cache", response_model=schemas.CacheStatsOut)
+async def get_search_cache_stats():
+    """Hit/miss/eviction counters of the /search result cache"""
+    return search_cache.stats()
+
+
+@app.get("/taxonomy/children", response_model=List[schemas.TaxonomyNodeOut], dependencies=[Depends(conditional_get)])
+async def get_taxonomy_children(path: str = "", db: AsyncSession = Depends(get_db)):
+    """List the ranks directly below a taxonomy path with sample counts"""
+    rows = (await db.execute(aggregate.children_statement(path))).all()
+    return [{"name": name, "count": count} for name, count in aggregate.children(rows, path)]
+
+
+@app.get("/taxonomy/rollup", response_model=List[schemas.RollupOut], dependencies=[Depends(conditional_get)])
+async def get_taxonomy_rollup(
+    depth: int = Query(2, ge=1),  # Ranks to keep, e.g. 2 = kingdom;phylum
+    group_by: Optional[str] = None,  # "location" or "user_id"
+    user_id: Optional[int] = None,
+    location: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Sample counts and total/mean abundance per taxon at a rank depth"""
+    if group_by is not None and group_by not in aggregate.GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {group_by}. Valid options: location, user_id")
     
-    return results
\ No newline at end of file
+    # SQL sums per distinct taxonomy string, Python folds those up to the rank
+    rows = (await db.execute(aggregate.rollup_statement(group_by, user_id, location))).all()
+    return await run_in_threadpool(aggregate.rollup, rows, depth, group_by is not None)
\ No newline at end of file
@@ -1,5 +1,20 @@
 import hashlib
+import hmac
 import os
+import time
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# Signs session tokens; set it so tokens survive restarts and work across API workers
+SESSION_SECRET = os.getenv("SESSION_SECRET", "").encode()
+if not SESSION_SECRET and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    # Each worker would sign with its own random key and reject the others' tokens
+    raise RuntimeError("Set SESSION_SECRET when running several workers (WEB_CONCURRENCY > 1)")
+SESSION_SECRET = SESSION_SECRET or os.urandom(32)
+SESSION_TTL = int(os.getenv("SESSION_TTL", "86400"))  # Seconds a token stays valid
+# Let writes name their user with a bare user_id parameter, as clients did before
+# session tokens; off by default, since anyone can send any user_id
+ALLOW_USER_ID_AUTH = os.getenv("ALLOW_USER_ID_AUTH", "0") == "1"
 
 def generate_salt():
     return os.urandom(16).hex()
@@ -8,4 +23,31 @@ def hash_password(password: str, salt: str):
     return hashlib.sha256((password + salt).encode()).hexdigest()
 
 def verify_password(password: str, salt: str, hashed_password: str):
-    return hash_password(password, salt) == hashed_password
\ No newline at end of file
+    return hmac.compare_digest(hash_password(password, salt), hashed_password)
+
+def _signature(payload: str) -> str:
+    return hmac.new(SESSION_SECRET, payload.encode(), hashlib.sha256).hexdigest()
+
+def issue_token(user_id: int) -> str:
+    # "<user_id>.<expiry>.<signature>"; checking it needs no database
+    payload = f"{user_id}.{int(time.time()) + SESSION_TTL}"
+    return f"{payload}.{_signature(payload)}"
+
+@lru_cache(maxsize=4096)
+def _token_identity(token: str) -> Optional[Tuple[int, int]]:
+    # (user_id, expiry) of a well-signed token, memoized so repeat requests skip the HMAC
+    payload, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(_signature(payload).encode(), signature.encode()):
+        return None
+    user_id, _, expires = payload.partition(".")
+    try:
+        return int(user_id), int(expires)
+    except ValueError:
+        return None
+
+def verify_token(token: str) -> Optional[int]:
+    """The user a session token was issued to, or None if it is forged or expired"""
+    identity = _token_identity(token)
+    if identity is None or identity[1] < time.time():
+        return None
+    return identity[0]
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Batch search: many /search queries answered from one read of the data.
+
+Every query is first resolved to the distinct taxonomy strings it matches:
+substring queries (exact, abundance) all at once with an Aho-Corasick
+automaton over the lineage table, hierarchical queries with a taxonomy
+trie built over that same read of the lineage table (so writes from other
+worker processes are seen) and approximate ones with the trigram index. The samples behind the
+union of those strings are then fetched in a single scan and handed out
+to the queries that matched them.
+"""
+from collections import deque
+from typing import Dict, Iterable, List, Set, Tuple
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import Session
+from . import metrics, models
+from .index import TaxonomyTrie
+
+STRATEGIES = ("exact", "approximate", "hierarchical", "abundance")
+
+
+class AhoCorasick:
+    # Multi-pattern substring matcher: one pass over a text reports every
+    # pattern occurring in it, however many patterns there are
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[int]] = [set()]  # Patterns ending at each state
+        self.always: Set[int] = set()  # Empty patterns, found in every text
+
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                self.always.add(index)
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                state = next_state
+            self._out[state].add(index)
+
+        # Breadth-first, so a state's failure link is final before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] |= self._out[self._fail[child]]
+
+    def find(self, text: str) -> Set[int]:
+        """Indexes of the patterns occurring in `text`"""
+        found = set(self.always)
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+def _matching_taxonomies(items: List, lineages: List[Tuple[int, str, str]],
+                         trigram_index) -> List[Dict[str, float]]:
+    # Per query, the matching taxonomy strings with their score (1.0 unless ranked)
+    matched: List[Dict[str, float]] = [{} for _ in items]
+
+    substring = [i for i, item in enumerate(items)
+                 if item.strategy == "exact" or (item.strategy == "abundance" and item.query)]
+    if substring:
+        automaton = AhoCorasick([items[i].query.lower() for i in substring])
+        for _, taxonomy, taxonomy_lower in lineages:
+            for pattern in automaton.find(taxonomy_lower):
+                matched[substring[pattern]][taxonomy] = 1.0
+
+    trie = None
+    if any(item.strategy == "hierarchical" for item in items):
+        # Keyed by lineage id rather than sample id; only the matching strings are used
+        trie = TaxonomyTrie()
+        trie.load_rows((lineage_id, taxonomy) for lineage_id, taxonomy, _ in lineages)
+
+    for i, item in enumerate(items):
+        if item.strategy == "hierarchical":
+            matched[i] = dict.fromkeys(trie.taxonomies(item.query), 1.0)
+        elif item.strategy == "approximate":
+            matched[i] = dict(trigram_index.search(item.query, item.threshold, item.limit))
+        elif item.strategy == "abundance" and not item.query:
+            matched[i] = {taxonomy: 1.0 for _, taxonomy, _ in lineages}
+    return matched
+
+
+def batch_search(db: Session, items: List, trigram_index) -> List[List[models.Sample]]:
+    """
+    Results of each query, in the same order as `items` (objects with the
+    /search parameters: query, strategy, min/max_abundance, threshold, limit).
+    `trigram_index` must be loaded.
+    """
+    with metrics.timed("batch", "filter"):
+        lineages = db.execute(select(models.Lineage.id, models.Lineage.taxonomy,
+                                     models.Lineage.taxonomy_lower)).all()
+        matched = _matching_taxonomies(items, lineages, trigram_index)
+
+    # Which queries want the samples of each lineage
+    lineage_of = {taxonomy: lineage_id for lineage_id, taxonomy, _ in lineages}
+    wanted: Dict[int, List[int]] = {}
+    for i, taxonomies in enumerate(matched):
+        for taxonomy in taxonomies:
+            lineage_id = lineage_of.get(taxonomy)
+            if lineage_id is not None:
+                wanted.setdefault(lineage_id, []).append(i)
+
+    results: List[List[models.Sample]] = [[] for _ in items]
+    if not wanted:
+        return results
+
+    with metrics.timed("batch", "fetch"):
+        statement = select(models.Sample).order_by(models.Sample.id)
+        if len(wanted) < len(lineages):
+            statement = statement.where(models.Sample.lineage_id.in_(
+                bindparam("lineage_ids", list(wanted), expanding=True, literal_execute=True)))
+        samples = db.scalars(statement).all()
+    metrics.SEARCH_ROWS_SCANNED.inc(len(samples), strategy="batch")
+
+    with metrics.timed("batch", "refine"):
+        for sample in samples:
+            for i in wanted.get(sample.lineage_id, ()):
+                item = items[i]
+                if item.strategy != "abundance" or item.min_abundance <= sample.abundance <= item.max_abundance:
+                    results[i].append(sample)
+
+        for i, item in enumerate(items):
+            if item.strategy == "approximate":
+                # Best matches first, as /search ranks them
+                scores = matched[i]
+                results[i].sort(key=lambda s: -scores[s.taxonomy])
+            if item.limit is not None:
+                results[i] = results[i][:item.limit]
+    metrics.SEARCH_ROWS_RETURNED.inc(sum(len(r) for r in results), strategy="batch")
+    return results
\ No newline at end of file
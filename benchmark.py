@@ -0,0 +1,264 @@
+"""
+Benchmark harness for the search strategies and the API.
+
+Generates a synthetic microbiome dataset, times every SearchStrategy on
+in-memory samples and every read endpoint through a TestClient against a
+scratch SQLite database, and writes latency percentiles, throughput and
+peak memory to a JSON file.
+
+    python -m app.benchmark --rows 50000 --duplication 0.9 --output bench.json
+    python -m app.benchmark --rows 50000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+
+def generate_dataset(rows: int, depth: int = 6, duplication: float = 0.8,
+                     abundance: str = "lognormal", users: int = 10, seed: int = 42) -> List[Dict]:
+    """
+    Synthetic samples. `duplication` is the share of rows that reuse an
+    already generated taxonomy string, so rows * (1 - duplication) strings
+    are distinct. Taxonomies come from a random tree `depth` ranks deep.
+    """
+    rng = random.Random(seed)
+
+    def rank_name(path: List[str], k: int) -> str:
+        # The k-th child of a node always gets the same name, so the ranks form a real tree
+        r = random.Random(f"{seed}:{';'.join(path)}:{k}")
+        return "".join(r.choice(string.ascii_lowercase) for _ in range(r.randint(5, 12))).capitalize()
+
+    # Branching chosen so the tree has roughly as many leaves as distinct taxonomies
+    distinct = max(1, round(rows * (1 - duplication)))
+    branching = max(2, round(distinct ** (1 / max(1, depth - 1))))
+    roots = ["Bacteria", "Archaea", "Fungi", "Viruses"]
+
+    taxonomies = []
+    seen = set()
+    while len(taxonomies) < distinct:
+        path = [rng.choice(roots)]
+        for _ in range(1, depth):
+            path.append(rank_name(path, rng.randrange(branching)))
+        taxonomy = ";".join(path)
+        if taxonomy in seen:
+            # Leaf already taken: hang a strain-level rank below it instead
+            taxonomy = f"{taxonomy};{rank_name(path, len(taxonomies))}"
+            if taxonomy in seen:
+                continue
+        seen.add(taxonomy)
+        taxonomies.append(taxonomy)
+
+    def draw_abundance() -> float:
+        if abundance == "uniform":
+            value = rng.uniform(0, 100)
+        elif abundance == "zipf":
+            value = 100.0 / rng.randint(1, 1000)
+        else:
+            value = rng.lognormvariate(0, 1.5)
+        return min(100.0, max(0.0, value))
+
+    locations = ["Gut", "Soil", "Ocean", "Skin", "Oral", "Freshwater"]
+    samples = []
+    for i in range(rows):
+        taxonomy = taxonomies[i] if i < distinct else rng.choice(taxonomies)
+        samples.append({
+            "name": f"Sample_{i:07d}",
+            "taxonomy": taxonomy,
+            "abundance": draw_abundance(),
+            "location": rng.choice(locations),
+            "user_id": i % users + 1,
+        })
+    rng.shuffle(samples)
+    return samples
+
+
+def pick_queries(samples: List[Dict], seed: int = 42) -> Dict[str, str]:
+    """One representative query per strategy, drawn from the dataset"""
+    rng = random.Random(seed)
+    parts = rng.choice(samples)["taxonomy"].split(";")
+    typo = list(";".join(parts[:3]).lower())
+    for _ in range(2):
+        typo[rng.randrange(len(typo))] = rng.choice(string.ascii_lowercase)
+    return {
+        "exact": parts[min(2, len(parts) - 1)][:6],
+        "approximate": "".join(typo),
+        "hierarchical": ";".join(parts[:2]),
+        "abundance": parts[0],
+    }
+
+
+def summarize(name: str, group: str, latencies: List[float], peak_memory: Optional[int], **extra) -> Dict:
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    total = sum(latencies)
+    return dict({
+        "group": group,
+        "name": name,
+        "runs": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+        "throughput_per_s": len(latencies) / total if total else None,
+        "peak_memory_bytes": peak_memory,
+    }, **extra)
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1):
+    """Latencies of `repeat` timed calls, then peak memory of one traced call"""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latencies, peak, result
+
+
+def bench_strategies(samples: List[Dict], queries: Dict[str, str], repeat: int) -> List[Dict]:
+    from . import models
+    from .strategy import (SearchContext, ExactMatchStrategy, ApproximateMatchStrategy,
+                           HierarchicalMatchStrategy, AbundanceFilterStrategy, normalize_taxonomy)
+
+    objects = [models.Sample(id=i + 1, **row) for i, row in enumerate(samples)]
+    strategies = {
+        "exact": ExactMatchStrategy(),
+        "approximate": ApproximateMatchStrategy(),
+        "hierarchical": HierarchicalMatchStrategy(),
+        "abundance": AbundanceFilterStrategy(10.0, 60.0),
+    }
+
+    results = []
+    for name, search_strategy in strategies.items():
+        context = SearchContext(search_strategy)
+        normalize_taxonomy.cache_clear()
+        latencies, peak, found = measure(lambda: context.execute_search(queries[name], objects), repeat)
+        results.append(summarize(name, "strategy", latencies, peak,
+                                 rows_scanned=len(objects), rows_returned=len(found)))
+    return results
+
+
+def bench_endpoints(samples: List[Dict], queries: Dict[str, str], repeat: int) -> List[Dict]:
+    from fastapi.testclient import TestClient
+    from . import api, ingest, models
+    from .database import SessionLocal
+
+    with SessionLocal() as db:
+        for user_id in sorted({row["user_id"] for row in samples}):
+            db.add(models.User(id=user_id, username=f"bench_{user_id}", hashed_password="-", salt="-"))
+        db.commit()
+        for user_id in sorted({row["user_id"] for row in samples}):
+            rows = ((i, row) for i, row in enumerate(samples, start=1) if row["user_id"] == user_id)
+            ingest.bulk_insert(db, user_id, rows, on_inserted=api._samples_added)
+
+    cases = {f"GET /search?strategy={name}": ("/search", {"query": query, "strategy": name,
+                                                          "min_abundance": 10.0, "max_abundance": 60.0})
+             for name, query in queries.items()}
+    cases.update({
+        "GET /samples/?limit=100": ("/samples/", {"limit": 100}),
+        "GET /samples/user/{id}": ("/samples/user/1", {}),
+        "GET /samples/user/{id}?limit=100": ("/samples/user/1", {"limit": 100}),
+        "GET /taxonomy/children": ("/taxonomy/children", {}),
+    })
+
+    results = []
+    with TestClient(api.app) as client:
+        for name, (path, params) in cases.items():
+            def call():
+                response = client.get(path, params=params)
+                response.raise_for_status()
+                return response
+
+            latencies, peak, response = measure(call, repeat)
+            results.append(summarize(name, "endpoint", latencies, peak,
+                                     response_bytes=len(response.content)))
+    return results
+
+
+def compare(current: List[Dict], previous_path: str):
+    with open(previous_path) as f:
+        previous = {(r["group"], r["name"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {previous_path} (p50, ratio > 1 is slower):")
+    for result in current:
+        before = previous.get((result["group"], result["name"]))
+        if before and before["p50_ms"]:
+            ratio = result["p50_ms"] / before["p50_ms"]
+            print(f"  {result['group']:<9} {result['name']:<40} {before['p50_ms']:>10.2f} -> "
+                  f"{result['p50_ms']:>10.2f} ms  x{ratio:.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=6, help="Taxonomy ranks per sample")
+    parser.add_argument("--duplication", type=float, default=0.8,
+                        help="Share of rows reusing an existing taxonomy string (0-1)")
+    parser.add_argument("--abundance", choices=["lognormal", "uniform", "zipf"], default="lognormal")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per case")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="Keep the /search result cache enabled")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="Previous output file to compare against")
+    args = parser.parse_args(argv)
+
+    # The app reads its settings at import time, so point it at a scratch
+    # database before anything from the package is imported
+    workdir = tempfile.mkdtemp(prefix="microbiome-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    if not args.cache:
+        os.environ["SEARCH_CACHE_SIZE"] = "0"
+
+    samples = generate_dataset(args.rows, args.depth, args.duplication, args.abundance, args.users, args.seed)
+    queries = pick_queries(samples, args.seed)
+
+    results = bench_strategies(samples, queries, args.repeat)
+    if not args.skip_endpoints:
+        results += bench_endpoints(samples, queries, args.repeat)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "params": vars(args),
+            "distinct_taxonomies": len({row["taxonomy"] for row in samples}),
+            "queries": queries,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        print(f"{result['group']:<9} {result['name']:<40} p50 {result['p50_ms']:>9.2f} ms  "
+              f"p99 {result['p99_ms']:>9.2f} ms  peak {result['peak_memory_bytes'] / 1e6:>8.1f} MB")
+    print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
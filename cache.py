@@ -0,0 +1,148 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import models
+
+GLOBAL_VERSION = 0  # data_versions row that covers every sample (user ids start at 1)
+
+
+class SearchCache:
+    # LRU cache of search results, bounded by size and age.
+    # Writes bump the generation, which makes every older entry stale.
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Dropped to make room
+        self.expired = 0  # Dropped for age or a newer generation
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (generation, expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                generation, expires_at, value = entry
+                if generation == self.generation and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any, generation: int):
+        """Store a result computed while `generation` was current"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return  # A write landed while the result was being computed
+            self._entries[key] = (generation, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+class DataVersions:
+    # Version numbers of the sample data, globally and per user, for ETags and
+    # cache keys. They live in the data_versions table and every write bumps
+    # them in its own transaction, so all worker processes agree on them.
+    # Counters start at a random value, so a recreated database doesn't hand
+    # out the versions (and ETags) of the old one again.
+
+    def initial(self) -> int:
+        return secrets.randbelow(2 ** 48)
+
+    def setup(self, db: Session):
+        """Create the missing counters: the global one and one per existing user"""
+        existing = set(db.scalars(select(models.DataVersion.user_id)))
+        missing = {GLOBAL_VERSION, *db.scalars(select(models.User.id))} - existing
+        if not missing:
+            return
+        db.add_all(models.DataVersion(user_id=user_id, version=self.initial()) for user_id in missing)
+        try:
+            db.commit()
+        except IntegrityError:  # Another worker starting up created them first
+            db.rollback()
+
+    def bump(self, db: Session, user_ids: Iterable[int] = ()) -> int:
+        """Advance the global version and the given users' ones, in db's open transaction; returns the global one"""
+        db.execute(update(models.DataVersion)
+                   .where(models.DataVersion.user_id.in_({GLOBAL_VERSION, *user_ids}))
+                   .values(version=models.DataVersion.version + 1))
+        return db.scalar(self.query())
+
+    def query(self, user_id: Optional[int] = None):
+        """Statement reading the version of one user's samples, or of all of them"""
+        return select(models.DataVersion.version).where(
+            models.DataVersion.user_id == (GLOBAL_VERSION if user_id is None else user_id))
+
+    def query_with_global(self, user_id: int):
+        """Statement reading (user_id, version) of one user's samples and of all of them"""
+        return select(models.DataVersion.user_id, models.DataVersion.version).where(
+            models.DataVersion.user_id.in_({GLOBAL_VERSION, user_id}))
+
+    def etag(self, version: int, resource: str) -> str:
+        """
+        Weak ETag for a resource (path and query) at a version: the gzip and
+        identity encodings of a response share it, so it can't be a strong one
+        """
+        digest = hashlib.blake2b(resource.encode(), digest_size=8).hexdigest()
+        return f'W/"{version}-{digest}"'
+
+
+class LoadedVersion:
+    # The global data version an in-memory copy of the samples reflects: set
+    # when the copy is built from the table, then advanced by this process's
+    # own writes as long as each follows directly on it. A write through
+    # another worker leaves a gap, so the copy stays stale until it is
+    # rebuilt. The owner serializes the calls under its own lock.
+
+    def __init__(self):
+        self.value: Optional[int] = None
+
+    def covers(self, version: int) -> bool:
+        return self.value is not None and self.value >= version
+
+    def written(self, version: int):
+        # The writes that bumped the global version to `version` were applied
+        if self.value is not None and self.value == version - 1:
+            self.value = version
+
+
+search_cache = SearchCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "60")),
+)
+
+data_versions = DataVersions()
\ No newline at end of file
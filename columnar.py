@@ -0,0 +1,182 @@
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from . import models
+from .cache import LoadedVersion
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency; the snapshot stays disabled without it
+    np = None
+
+
+class ColumnarSnapshot:
+    # NumPy column arrays of the samples table (id, user_id, abundance and
+    # dictionary-encoded taxonomy), so strategies can filter with boolean masks.
+    # Inserts are buffered and appended on the next read; deletes clear a
+    # liveness flag and the arrays are compacted once enough rows are dead.
+    # Writes through other workers make it stale; it is then rebuilt.
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled and np is not None
+        self._lock = threading.RLock()
+        self._version = LoadedVersion()
+        self._clear()
+
+    def current(self, version: int) -> bool:
+        """Whether the snapshot holds every write up to the global data `version`"""
+        with self._lock:
+            return self.loaded and self._version.covers(version)
+
+    def load(self, db, version: Optional[int] = None):
+        """
+        Build the arrays from the samples table: once, or, given the global data
+        `version` read before, again from scratch until they hold every write up to it
+        """
+        with self._lock:
+            if self.loaded and (version is None or self._version.covers(version)):
+                return
+            self._clear()
+            rows = db.query(models.Sample.id, models.Sample.user_id, models.Sample.abundance,
+                            models.Sample.taxonomy).order_by(models.Sample.id).yield_per(50000)
+            self.load_rows(rows)
+            self._version.value = version
+
+    def load_rows(self, rows: Iterable[Tuple[int, int, float, str]]):
+        """Build the arrays from (id, user_id, abundance, taxonomy) rows"""
+        with self._lock:
+            for sample_id, user_id, abundance, taxonomy in rows:
+                self._pending.append((sample_id, user_id or 0, abundance or 0.0, self._code(taxonomy)))
+            self._flush()
+            self.loaded = True
+
+    def add(self, sample_id: int, user_id: int, abundance: float, taxonomy: str):
+        with self._lock:
+            if self.loaded:
+                self._pending.append((sample_id, user_id or 0, abundance or 0.0, self._code(taxonomy)))
+
+    def remove(self, sample_id: int):
+        with self._lock:
+            if not self.loaded:
+                return
+            self._flush()
+            position = int(np.searchsorted(self.ids, sample_id))
+            if position < len(self.ids) and self.ids[position] == sample_id and self.alive[position]:
+                self.alive[position] = False
+                self._dead += 1
+                if self._dead > len(self.ids) // 4:
+                    self._compact()
+
+    def written(self, version: int):
+        """The writes that bumped the global data version to `version` were added or removed"""
+        with self._lock:
+            self._version.written(version)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.ids) + len(self._pending) - self._dead
+
+    def taxonomy_mask(self, verdict: Callable[[str], bool]):
+        """Rows whose taxonomy passes `verdict`, which runs once per distinct string"""
+        with self._lock:
+            self._flush()
+            code_verdicts = np.fromiter((verdict(t) for t in self.taxonomies), dtype=bool,
+                                        count=len(self.taxonomies))
+            return self.alive & code_verdicts[self.codes]
+
+    def abundance_mask(self, low: float, high: float):
+        with self._lock:
+            self._flush()
+            return self.alive & (self.abundance >= low) & (self.abundance <= high)
+
+    def ranked_ids(self, score: Callable[[str], Optional[float]],
+                   limit: Optional[int] = None) -> List[Tuple[float, int]]:
+        """
+        (-score, id) of the rows whose taxonomy gets a score (None = no match),
+        best first and by id among equals. `score` runs once per distinct string.
+        """
+        with self._lock:
+            self._flush()
+            code_scores = np.fromiter((np.nan if s is None else s for s in map(score, self.taxonomies)),
+                                      dtype=np.float64, count=len(self.taxonomies))
+            row_scores = code_scores[self.codes]
+            mask = self.alive & ~np.isnan(row_scores)
+            ids = self.ids[mask]
+            keys = -row_scores[mask]
+        order = np.lexsort((ids, keys))
+        if limit is not None:
+            order = order[:limit]
+        return list(zip(keys[order].tolist(), ids[order].tolist()))
+
+    def select(self, build_mask: Callable[[], "np.ndarray"], after: Optional[int] = None,
+               limit: Optional[int] = None) -> List[int]:
+        """
+        Ids under the mask `build_mask()` returns, in id order, after the cursor
+        and up to `limit`. The mask is built and applied under one hold of the
+        lock, so rows other threads add or compact away can't change its shape.
+        """
+        with self._lock:
+            mask = build_mask()  # May flush pending rows, so before reading self.ids
+            ids = self.ids[mask]
+        if after is not None:
+            ids = ids[np.searchsorted(ids, after, side="right"):]
+        if limit is not None:
+            ids = ids[:limit]
+        return ids.tolist()
+
+    def _clear(self):
+        self.loaded = False
+        self.taxonomies: List[str] = []  # Code -> taxonomy string
+        self._codes_of: Dict[str, int] = {}
+        self._pending: List[tuple] = []  # (id, user_id, abundance, code) not yet in the arrays
+        self._dead = 0
+        if np is not None:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.user_ids = np.empty(0, dtype=np.int64)
+            self.abundance = np.empty(0, dtype=np.float64)
+            self.codes = np.empty(0, dtype=np.int32)
+            self.alive = np.empty(0, dtype=bool)
+
+    def _code(self, taxonomy: str) -> int:
+        code = self._codes_of.get(taxonomy)
+        if code is None:
+            code = self._codes_of[taxonomy] = len(self.taxonomies)
+            self.taxonomies.append(taxonomy)
+        return code
+
+    def _flush(self):
+        if not self._pending:
+            return
+        ids, user_ids, abundance, codes = zip(*self._pending)
+        self._pending = []
+        new_ids = np.array(ids, dtype=np.int64)
+        in_order = (np.all(new_ids[1:] > new_ids[:-1])
+                    and (len(self.ids) == 0 or new_ids[0] > self.ids[-1]))
+
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.user_ids = np.concatenate([self.user_ids, np.array(user_ids, dtype=np.int64)])
+        self.abundance = np.concatenate([self.abundance, np.array(abundance, dtype=np.float64)])
+        self.codes = np.concatenate([self.codes, np.array(codes, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(new_ids), dtype=bool)])
+
+        if not in_order:
+            # Ids normally arrive increasing. Otherwise a reused id or a row seen
+            # both by load() and add() needs sorting out: drop dead rows, then
+            # keep one row per id, in id order.
+            self._compact()
+            _, first = np.unique(self.ids, return_index=True)
+            self._reorder(first)
+
+    def _compact(self):
+        self._reorder(np.flatnonzero(self.alive))
+        self._dead = 0
+
+    def _reorder(self, positions):
+        self.ids = self.ids[positions]
+        self.user_ids = self.user_ids[positions]
+        self.abundance = self.abundance[positions]
+        self.codes = self.codes[positions]
+        self.alive = self.alive[positions]
+
+
+columnar_snapshot = ColumnarSnapshot(enabled=os.getenv("COLUMNAR_SNAPSHOT", "0") == "1")
\ No newline at end of file
@@ -1,9 +1,99 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+
+
+def _async_url(url: str) -> str:
+    # The same database through an asyncio driver
+    scheme, rest = url.split(":", 1)
+    if scheme == "sqlite":
+        return "sqlite+aiosqlite:" + rest
+    if scheme in ("postgresql", "postgresql+psycopg2", "postgres"):
+        return "postgresql+asyncpg:" + rest
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+# Connection pool, per process (each uvicorn worker gets its own engine)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a free connection
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds before a connection is replaced
+
+# SQLite tuning
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+is_sqlite = DATABASE_URL.startswith("sqlite")
+is_sqlite_memory = is_sqlite and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:")
+
+if is_sqlite_memory:
+    # An in-memory database lives in its connection, so every session shares one.
+    # The sync and async engines each get their own, so use a file for anything real.
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=StaticPool)
+else:
+    pool_options = dict(
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        **pool_options
+    )
+    # Serves the async request path; the sync engine is kept for work that
+    # runs in threads (bulk ingest, streamed responses, index loading)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options)
+
+
+if is_sqlite:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets readers run alongside a writer; NORMAL sync is safe under WAL"""
+        cursor = dbapi_connection.cursor()
+        if not is_sqlite_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.close()
 
-DATABASE_URL = "sqlite:///./test.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+Base = declarative_base()
+
+
+def begin_write(db: Session):
+    """
+    Open db's transaction holding the database's write lock, for writes that
+    read rows and write back values computed from them. Call it before the
+    transaction's first statement. SQLite ignores FOR UPDATE and only starts
+    a transaction at the first write, so without this concurrent writers
+    read the same rows; other databases lock them with FOR UPDATE instead.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def insert_ignoring_conflicts(db: Session, model, index_elements):
+    """INSERT that skips rows already present under a unique key, where the dialect can"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing(index_elements=index_elements)
\ No newline at end of file
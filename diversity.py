@@ -0,0 +1,380 @@
+"""
+Alpha and beta diversity of groups of samples.
+
+Alpha diversity (richness, Shannon, Simpson) is kept per group in summary
+tables that every write updates, so reading it never scans the samples.
+
+For beta diversity the samples table is folded into a sparse group x taxon abundance matrix
+(CSR arrays, one column per lineage). Pairwise Bray-Curtis or Jaccard
+distances are computed in row blocks into a memory-mapped N x N float32
+file, in a process pool once N is large. Each block only considers the
+taxa its own rows contain, densified a chunk of columns at a time, so the
+work follows the sparsity and the memory stays bounded.
+"""
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from . import models
+from .database import insert_ignoring_conflicts
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency; the endpoint reports it as unavailable
+    np = None
+
+GROUP_COLUMNS = {
+    "location": models.Sample.location,
+    "name": models.Sample.name,
+}
+METRICS = ("braycurtis", "jaccard")
+
+WORKERS = int(os.getenv("DIVERSITY_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_MIN_GROUPS = int(os.getenv("DIVERSITY_PARALLEL_MIN_GROUPS", "2000"))  # Below this, one process
+BLOCK_ELEMENTS = 1 << 22  # Bound on each dense temporary of one distance step
+# The pool starts from a request thread; forking there would copy locks held by other threads
+POOL_CONTEXT = multiprocessing.get_context("forkserver")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class AbundanceMatrix:
+    # Sparse group x taxon matrix in CSR form: row i holds data[indptr[i]:indptr[i + 1]]
+    # at columns indices[indptr[i]:indptr[i + 1]]
+
+    def __init__(self, labels: List[str], indptr, indices, data):
+        self.labels = labels
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def save(self, directory: str):
+        for name in ("indptr", "indices", "data"):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def open(cls, directory: str) -> "AbundanceMatrix":
+        """Memory-map the arrays written by save(), as pool workers do"""
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                  for name in ("indptr", "indices", "data")]
+        return cls([""] * (len(arrays[0]) - 1), *arrays)
+
+
+def abundance_matrix(db: Session, group_by: str, user_id: Optional[int] = None) -> AbundanceMatrix:
+    """Summed abundance per (group, lineage), aggregated in SQL"""
+    group_column = GROUP_COLUMNS[group_by]
+    statement = (
+        select(group_column, models.Sample.lineage_id, func.sum(models.Sample.abundance))
+        .where(group_column.is_not(None), models.Sample.lineage_id.is_not(None))
+        .group_by(group_column, models.Sample.lineage_id)
+        .order_by(group_column)
+    )
+    if user_id is not None:
+        statement = statement.where(models.Sample.user_id == user_id)
+
+    labels, indptr, indices, data = [], [0], [], []
+    for group, lineage_id, total in db.execute(statement):
+        if not labels or labels[-1] != group:
+            if labels:
+                indptr.append(len(indices))
+            labels.append(group)
+        indices.append(lineage_id)
+        data.append(total or 0.0)
+    if labels:
+        indptr.append(len(indices))
+    return AbundanceMatrix(labels, np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64),
+                           np.array(data, dtype=np.float64))
+
+
+def _column_entries(matrix: AbundanceMatrix, rows, columns):
+    # (row, column position, value) of the entries of `rows` that fall in the
+    # sorted `columns`, ordered by column position so a chunk is one slice
+    counts = np.diff(matrix.indptr[rows.start:rows.stop + 1])
+    row_of = np.repeat(np.arange(len(counts)), counts)
+    entries = slice(matrix.indptr[rows.start], matrix.indptr[rows.stop])
+    indices = np.asarray(matrix.indices[entries])
+    positions = np.searchsorted(columns, indices)
+    keep = (positions < len(columns)) & (columns[np.minimum(positions, max(0, len(columns) - 1))] == indices)
+    order = np.argsort(positions[keep], kind="stable")
+    return row_of[keep][order], positions[keep][order], np.asarray(matrix.data[entries])[keep][order]
+
+
+def _dense_chunk(entries, n_rows: int, first: int, last: int):
+    # Dense n_rows x (last - first) block of the entries in column positions [first, last)
+    rows, positions, values = entries
+    low, high = np.searchsorted(positions, [first, last])
+    dense = np.zeros((n_rows, last - first), dtype=np.float64)
+    dense[rows[low:high], positions[low:high] - first] = values[low:high]
+    return dense
+
+
+def distance_rows(matrix: AbundanceMatrix, metric: str, start: int, stop: int):
+    """Distances of rows [start, stop) to every row"""
+    n = len(matrix.indptr) - 1
+    block_entries = slice(matrix.indptr[start], matrix.indptr[stop])
+    # Only taxa present in this block can contribute to a shared term
+    columns = np.unique(np.asarray(matrix.indices[block_entries]))
+    own_entries = _column_entries(matrix, slice(start, stop), columns)
+    other_entries = _column_entries(matrix, slice(0, n), columns)
+    row_of = np.repeat(np.arange(n), np.diff(matrix.indptr))
+    data = np.asarray(matrix.data)
+
+    # The taxa are densified a chunk of columns at a time, so no temporary
+    # grows past BLOCK_ELEMENTS however many groups and taxa there are
+    width = max(1, BLOCK_ELEMENTS // max(1, n))
+    shared = np.zeros((stop - start, n), dtype=np.float64)
+    for first in range(0, len(columns), width):
+        last = min(len(columns), first + width)
+        own = _dense_chunk(own_entries, stop - start, first, last)
+        other = _dense_chunk(other_entries, n, first, last)
+        if metric == "jaccard":
+            shared += (own > 0).astype(np.float32) @ (other > 0).astype(np.float32).T
+        else:
+            step = max(1, BLOCK_ELEMENTS // max(1, n * (last - first)))
+            for i in range(0, stop - start, step):
+                shared[i:i + step] += np.minimum(own[i:i + step, None, :], other[None, :, :]).sum(axis=2)
+
+    if metric == "jaccard":
+        richness = np.bincount(row_of, weights=(data > 0).astype(np.float64), minlength=n)
+        union = richness[start:stop, None] + richness[None, :] - shared
+        with np.errstate(invalid="ignore", divide="ignore"):
+            distances = np.where(union > 0, 1 - shared / union, 0.0)
+    else:
+        # Bray-Curtis: 1 - 2 * sum(min(a, b)) / (sum(a) + sum(b))
+        totals = np.bincount(row_of, weights=data, minlength=n)
+        denominator = totals[start:stop, None] + totals[None, :]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            distances = np.where(denominator > 0, 1 - 2 * shared / denominator, 0.0)
+    return distances.astype(np.float32)
+
+
+def _write_rows(directory: str, metric: str, start: int, stop: int):
+    # Pool task: read the shared matrix and write one band of the output file
+    matrix = AbundanceMatrix.open(directory)
+    output = np.load(os.path.join(directory, "distances.npy"), mmap_mode="r+")
+    output[start:stop] = distance_rows(matrix, metric, start, stop)
+    output.flush()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=POOL_CONTEXT)
+    return _pool
+
+
+def distance_matrix(matrix: AbundanceMatrix, metric: str, directory: str):
+    """
+    Write the N x N distance matrix to `directory`/distances.npy and return
+    it memory-mapped. Large matrices are split into row bands across the
+    process pool, which read the inputs from the same directory.
+    """
+    n = len(matrix)
+    output = np.lib.format.open_memmap(os.path.join(directory, "distances.npy"), mode="w+",
+                                       dtype=np.float32, shape=(n, n))
+    if n >= PARALLEL_MIN_GROUPS and WORKERS > 1:
+        del output  # Workers write through their own mappings
+        matrix.save(directory)
+        band = max(1, -(-n // (WORKERS * 4)))
+        futures = [_get_pool().submit(_write_rows, directory, metric, start, min(n, start + band))
+                   for start in range(0, n, band)]
+        for future in futures:
+            future.result()
+        return np.load(os.path.join(directory, "distances.npy"), mmap_mode="r")
+
+    band = max(1, BLOCK_ELEMENTS // max(1, n))
+    for start in range(0, n, band):
+        output[start:start + band] = distance_rows(matrix, metric, start, min(n, start + band))
+    output.flush()
+    return output
+
+
+def tsv_lines(labels: List[str], distances, batch: int = 256) -> Iterator[str]:
+    """The matrix as a labelled tab-separated table, a few rows at a time"""
+    yield "\t".join(["", *map(str, labels)]) + "\n"
+    for start in range(0, len(labels), batch):
+        lines = []
+        for label, row in zip(labels[start:start + batch], distances[start:start + batch]):
+            lines.append("\t".join([str(label), *(f"{value:.6g}" for value in row.tolist())]))
+        yield "\n".join(lines) + "\n"
+
+
+# Alpha diversity. group_taxa keeps each group's total per lineage and
+# group_diversity its running sums; a write only touches the lineages it
+# changes. With A = sum(a) over lineages:
+#   Shannon H = ln A - sum(a ln a) / A      Simpson 1 - D = 1 - sum(a^2) / A^2
+
+ALPHA_GROUP_COLUMNS = dict(zip(models.DIVERSITY_GROUPS,
+                               (models.Sample.name, models.Sample.location, models.Sample.user_id)))
+
+ROUNDING_TOLERANCE = 1e-9
+
+AlphaSample = Tuple[str, str, int, Optional[int], float]  # (name, location, user_id, lineage_id, abundance)
+
+
+def _a_log_a(a: float) -> float:
+    return a * math.log(a) if a > 0 else 0.0
+
+
+def _in(column, name: str, values):
+    return column.in_(bindparam(name, list(values), expanding=True, literal_execute=True))
+
+
+def _empty_summary(kind: str, value: str) -> Dict:
+    return {"kind": kind, "value": value, "samples": 0, "richness": 0,
+            "total_abundance": 0.0, "sum_a_log_a": 0.0, "sum_a_squared": 0.0}
+
+
+def update_alpha(db: Session, samples: Iterable[AlphaSample], sign: int = 1):
+    """
+    Fold samples into the group summaries, or take them out with sign=-1.
+    Runs in the caller's transaction, so the summaries commit with the rows;
+    on SQLite that transaction must hold the write lock (begin_write).
+    """
+    deltas: Dict[Tuple[str, str, int], list] = {}  # (kind, value, lineage) -> [abundance, samples]
+    for name, location, user_id, lineage_id, abundance in samples:
+        if lineage_id is None:
+            continue
+        for kind, value in zip(models.DIVERSITY_GROUPS, (name, location, user_id)):
+            if value is not None:
+                delta = deltas.setdefault((kind, str(value), lineage_id), [0.0, 0])
+                delta[0] += sign * (abundance or 0.0)
+                delta[1] += sign
+    if not deltas:
+        return
+
+    # Current rows, locked so concurrent writers apply their deltas in turn. A
+    # group's taxa only change under its locked summary row, so groups new to
+    # this write get a zeroed one first (kept if a concurrent writer adds it too)
+    Taxon, Summary = models.GroupTaxon, models.GroupDiversity
+    taxa: Dict[tuple, list] = {}  # (kind, value, lineage) -> [id, abundance, samples]
+    summaries: Dict[tuple, dict] = {}  # (kind, value) -> column values
+    for kind in models.DIVERSITY_GROUPS:
+        keys = [key for key in deltas if key[0] == kind]
+        if not keys:
+            continue
+        values = {value for _, value, _ in keys}
+        missing = values.difference(db.scalars(select(Summary.value).where(
+            Summary.kind == kind, _in(Summary.value, "group_values", values))))
+        if missing:
+            db.execute(insert_ignoring_conflicts(db, Summary, ["kind", "value"]),
+                       [_empty_summary(kind, value) for value in missing])
+        for summary in db.execute(select(Summary.__table__).where(
+                Summary.kind == kind, _in(Summary.value, "group_values", values))
+                .order_by(Summary.value).with_for_update()).mappings():
+            summaries[(kind, summary["value"])] = dict(summary)
+        for taxon_id, value, lineage_id, abundance, count in db.execute(
+                select(Taxon.id, Taxon.value, Taxon.lineage_id, Taxon.abundance, Taxon.samples).where(
+                    Taxon.kind == kind, _in(Taxon.value, "group_values", values),
+                    _in(Taxon.lineage_id, "lineage_ids", {lineage for _, _, lineage in keys}))
+                .with_for_update()):
+            taxa[(kind, value, lineage_id)] = [taxon_id, abundance, count]
+
+    new_taxa, changed_taxa, emptied_taxa = [], [], []
+    for (kind, value, lineage_id), (abundance, count) in deltas.items():
+        taxon_id, old, samples_before = taxa.get((kind, value, lineage_id), (None, 0.0, 0))
+        summary = summaries.get((kind, value))
+        if summary is None:  # Emptied and deleted by a concurrent writer since
+            summary = summaries[(kind, value)] = {"id": None, **_empty_summary(kind, value)}
+
+        samples_after = samples_before + count
+        new = old + abundance
+        if samples_after <= 0 or new < ROUNDING_TOLERANCE:
+            # Take-outs leave float residue; an emptied lineage must count as absent
+            new = 0.0
+        summary["samples"] += count
+        summary["total_abundance"] += new - old
+        summary["sum_a_log_a"] += _a_log_a(new) - _a_log_a(old)
+        summary["sum_a_squared"] += new * new - old * old
+        summary["richness"] += (new > 0) - (old > 0)
+
+        if samples_after <= 0:
+            if taxon_id is not None:
+                emptied_taxa.append(taxon_id)
+        elif taxon_id is None:
+            new_taxa.append({"kind": kind, "value": value, "lineage_id": lineage_id,
+                             "abundance": new, "samples": samples_after})
+        else:
+            changed_taxa.append({"id": taxon_id, "abundance": new, "samples": samples_after})
+
+    # Plain executemany statements; the ORM unit of work is too slow for bulk loads
+    if new_taxa:
+        db.execute(insert(Taxon), new_taxa)
+    if changed_taxa:
+        db.execute(update(Taxon), changed_taxa)
+    if emptied_taxa:
+        db.execute(delete(Taxon).where(_in(Taxon.id, "taxon_ids", emptied_taxa)))
+
+    new_summaries = [{k: v for k, v in s.items() if k != "id"}
+                     for s in summaries.values() if s["id"] is None and s["samples"] > 0]
+    changed_summaries = [s for s in summaries.values() if s["id"] is not None and s["samples"] > 0]
+    emptied_summaries = [s["id"] for s in summaries.values() if s["id"] is not None and s["samples"] <= 0]
+    if new_summaries:
+        db.execute(insert(Summary), new_summaries)
+    if changed_summaries:
+        db.execute(update(Summary), changed_summaries)
+    if emptied_summaries:
+        db.execute(delete(Summary).where(_in(Summary.id, "summary_ids", emptied_summaries)))
+
+
+def rebuild_alpha(db: Session) -> int:
+    """Recompute every group summary from the samples table; returns the group count"""
+    db.execute(delete(models.GroupTaxon))
+    db.execute(delete(models.GroupDiversity))
+    groups = 0
+    for kind, column in ALPHA_GROUP_COLUMNS.items():
+        rows = db.execute(
+            select(column, models.Sample.lineage_id, func.sum(models.Sample.abundance), func.count())
+            .where(column.is_not(None), models.Sample.lineage_id.is_not(None))
+            .group_by(column, models.Sample.lineage_id)
+        ).all()
+        taxa, sums = [], {}
+        for value, lineage_id, abundance, count in rows:
+            value, abundance = str(value), abundance or 0.0
+            taxa.append({"kind": kind, "value": value, "lineage_id": lineage_id,
+                         "abundance": abundance, "samples": count})
+            summary = sums.setdefault(value, _empty_summary(kind, value))
+            summary["samples"] += count
+            summary["richness"] += abundance > 0
+            summary["total_abundance"] += abundance
+            summary["sum_a_log_a"] += _a_log_a(abundance)
+            summary["sum_a_squared"] += abundance * abundance
+        if taxa:
+            db.execute(insert(models.GroupTaxon), taxa)
+            db.execute(insert(models.GroupDiversity), list(sums.values()))
+        groups += len(sums)
+    db.commit()
+    return groups
+
+
+def backfill_alpha(db: Session) -> int:
+    """Build the summaries once for a database that has samples but none yet"""
+    if db.scalar(select(models.GroupDiversity.id).limit(1)) is not None:
+        return 0
+    if db.scalar(select(models.Sample.id).limit(1)) is None:
+        return 0
+    return rebuild_alpha(db)
+
+
+def alpha_metrics(summary: models.GroupDiversity) -> Dict:
+    """Richness, Shannon and Simpson (1 - D) of a group, from its running sums"""
+    total = summary.total_abundance
+    if total > 0:
+        shannon = max(0.0, math.log(total) - summary.sum_a_log_a / total)
+        simpson = min(1.0, max(0.0, 1 - summary.sum_a_squared / (total * total)))
+    else:
+        shannon = simpson = 0.0
+    return {
+        "group": summary.value,
+        "samples": summary.samples,
+        "richness": summary.richness,
+        "total_abundance": total,
+        "shannon": shannon,
+        "simpson": simpson,
+    }
\ No newline at end of file
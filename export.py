@@ -0,0 +1,109 @@
+"""
+Streamed table export. Rows come in from a server-side cursor and leave
+as CSV text, Parquet row groups or Arrow IPC record batches, one batch at
+a time, so memory stays bounded however large the export is.
+"""
+import csv
+import io
+from typing import Iterable, Iterator, List
+from .strategy import batched
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional dependency; only CSV is offered without it
+    pa = pq = None
+
+BATCH_SIZE = 10000  # Rows per CSV chunk, Parquet row group or Arrow record batch
+COLUMNS = ("id", "name", "taxonomy", "abundance", "location", "user_id")
+
+FORMATS = {
+    # format -> (media type, file extension)
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def available(output: str) -> bool:
+    return output == "csv" or pa is not None
+
+
+def csv_chunks(rows: Iterable, batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batched(rows, batch_size):
+        writer.writerows([tuple(getattr(row, column) for column in COLUMNS) for row in batch])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # Header of an empty export
+
+
+class _Drain:
+    # Write-only file object whose contents are taken out after every batch
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("name", pa.string()),
+        ("taxonomy", pa.string()),
+        ("abundance", pa.float64()),
+        ("location", pa.string()),
+        ("user_id", pa.int64()),
+    ])
+
+
+def arrow_chunks(rows: Iterable, output: str, batch_size: int = BATCH_SIZE) -> Iterator[bytes]:
+    """Parquet (one row group per batch) or an Arrow IPC stream"""
+    schema = _schema()
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema) if output == "parquet" else pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in batched(rows, batch_size):
+            columns = [pa.array([getattr(row, column) for row in batch], type=field.type)
+                       for column, field in zip(COLUMNS, schema)]
+            table = pa.Table.from_arrays(columns, schema=schema)
+            if output == "parquet":
+                writer.write_table(table)
+            else:
+                writer.write(table)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()  # Parquet footer / end-of-stream marker
+
+
+def encode(rows: Iterable, output: str) -> Iterator:
+    """Chunks of the export of `rows` (objects with the COLUMNS attributes)"""
+    if output == "csv":
+        return csv_chunks(rows)
+    return arrow_chunks(rows, output)
\ No newline at end of file
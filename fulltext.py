@@ -0,0 +1,90 @@
+"""
+SQLite FTS5 index over samples.name, taxonomy and location.
+
+`samples_fts` is an external-content FTS5 table: it stores only the index
+and reads the text from `samples`. Triggers keep it in sync with every
+insert, delete and update, bulk loads included. Other databases (or
+SQLite builds without FTS5) go without it and the `fulltext` strategy
+reports itself unavailable.
+"""
+import re
+from typing import List, Optional
+from sqlalchemy import column, table, text
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = "samples_fts"
+COLUMNS = ("name", "taxonomy", "location")
+
+# rowid is the sample id, rank the BM25 score of the current MATCH (lower is better)
+samples_fts = table(FTS_TABLE, column("rowid"), column("rank"), column(FTS_TABLE))
+
+available = False
+
+_CREATE = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, taxonomy, location, content='samples', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON samples BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, taxonomy, location)
+        VALUES (new.id, new.name, new.taxonomy, new.location);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON samples BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, taxonomy, location)
+        VALUES ('delete', old.id, old.name, old.taxonomy, old.location);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, taxonomy, location ON samples BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, taxonomy, location)
+        VALUES ('delete', old.id, old.name, old.taxonomy, old.location);
+        INSERT INTO {FTS_TABLE}(rowid, name, taxonomy, location)
+        VALUES (new.id, new.name, new.taxonomy, new.location);
+    END""",
+]
+# Index the rows that predate the table
+_REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+
+def setup(engine) -> bool:
+    """
+    Create whatever part of the index and its triggers is missing, in one
+    transaction, so a start interrupted halfway or racing another worker
+    still ends with all of them; False if SQLite lacks FTS5
+    """
+    global available
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                  {"name": FTS_TABLE}).first()
+            for statement in _CREATE:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(_REBUILD))
+    except OperationalError as error:
+        if "no such module: fts5" not in str(error):
+            raise
+        return False
+    available = True
+    return True
+
+
+def tokens(value: str) -> List[str]:
+    """Words the way the unicode61 tokenizer splits them (';', '_' etc. separate)"""
+    return re.findall(r"[^\W_]+", value.lower())
+
+
+def parse_query(query: str) -> List[str]:
+    """Query terms; a trailing '*' makes a term a prefix match"""
+    return re.findall(r"[^\W_]+\*?", query.lower())
+
+
+def match_expression(query: str) -> Optional[str]:
+    """
+    FTS5 MATCH syntax for a user query: every term is quoted, so operators
+    and column filters in the input are taken literally, and all terms
+    must occur. None when the query has no terms.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return None
+    return " ".join(f'"{term.rstrip("*")}"*' if term.endswith("*") else f'"{term}"' for term in terms)
\ No newline at end of file
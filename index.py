@@ -0,0 +1,271 @@
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from . import models
+from .cache import LoadedVersion
+from .strategy import similarity
+
+
+def split_taxonomy(taxonomy: str) -> List[str]:
+    # Normalized ranks, the same way HierarchicalMatchStrategy compares them
+    return [part.strip().lower() for part in taxonomy.split(';')]
+
+
+class TaxonomyNode:
+    # One rank in the taxonomy trie
+
+    __slots__ = ("label", "children", "samples", "count")
+
+    def __init__(self, label: str = ""):
+        self.label = label  # Rank name as first written
+        self.children: Dict[str, "TaxonomyNode"] = {}
+        self.samples: Dict[str, Set[int]] = {}  # Full taxonomy string -> ids of samples ending here
+        self.count = 0  # Samples in this subtree
+
+
+class SampleIndex(ABC):
+    # In-memory index over samples.taxonomy.
+    # Built from the table, then kept current by this process's write
+    # endpoints; rebuilt once writes through other workers made it stale.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._taxonomy_of: Dict[int, str] = {}
+        self._version = LoadedVersion()
+        self.loaded = False
+
+    def current(self, version: int) -> bool:
+        """Whether the index holds every write up to the global data `version`"""
+        with self._lock:
+            return self.loaded and self._version.covers(version)
+
+    def load(self, db, version: Optional[int] = None):
+        """
+        Build the index from the samples table: once, or, given the global data
+        `version` read before, again from scratch until it holds every write up to it
+        """
+        with self._lock:
+            if self.loaded and (version is None or self._version.covers(version)):
+                return
+            self._clear()
+            self.load_rows(db.query(models.Sample.id, models.Sample.taxonomy).yield_per(10000))
+            self._version.value = version
+
+    def load_rows(self, rows: Iterable[Tuple[int, str]]):
+        """Build the index from (id, taxonomy) rows"""
+        with self._lock:
+            for sample_id, taxonomy in rows:
+                self._insert(sample_id, taxonomy)
+            self.loaded = True
+
+    def add(self, sample_id: int, taxonomy: str):
+        with self._lock:
+            if self.loaded:
+                self._insert(sample_id, taxonomy)
+
+    def remove(self, sample_id: int):
+        with self._lock:
+            if self.loaded:
+                self._remove(sample_id)
+
+    def written(self, version: int):
+        """The writes that bumped the global data version to `version` were added or removed"""
+        with self._lock:
+            self._version.written(version)
+
+    def _clear(self):
+        self._taxonomy_of = {}
+        self.loaded = False
+
+    @abstractmethod
+    def _insert(self, sample_id: int, taxonomy: str):
+        pass
+
+    @abstractmethod
+    def _remove(self, sample_id: int):
+        pass
+
+
+class TaxonomyTrie(SampleIndex):
+    # Prefix tree over the ';'-separated ranks of samples.taxonomy
+
+    def __init__(self):
+        super().__init__()
+        self._root = TaxonomyNode()
+
+    def _clear(self):
+        super()._clear()
+        self._root = TaxonomyNode()
+
+    def taxonomies(self, query: str) -> List[str]:
+        """Distinct taxonomy strings matching a hierarchical query"""
+        with self._lock:
+            result = []
+            stack = self._match(query)
+            while stack:
+                node = stack.pop()
+                result.extend(node.samples)
+                stack.extend(node.children.values())
+            return result
+
+    def _match(self, query: str) -> List[TaxonomyNode]:
+        # Nodes whose path matches the query rank by rank (substring per rank,
+        # as in HierarchicalMatchStrategy), so only the children of matching
+        # nodes are inspected at each depth
+        nodes = [self._root]
+        for part in split_taxonomy(query):
+            nodes = [child for node in nodes
+                     for key, child in node.children.items() if part in key]
+            if not nodes:
+                break
+        return nodes
+
+    def _insert(self, sample_id: int, taxonomy: str):
+        if taxonomy is None or sample_id in self._taxonomy_of:
+            return
+        self._taxonomy_of[sample_id] = taxonomy
+
+        node = self._root
+        node.count += 1
+        for part, raw in zip(split_taxonomy(taxonomy), taxonomy.split(';')):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = TaxonomyNode(raw.strip())
+            child.count += 1
+            node = child
+        node.samples.setdefault(taxonomy, set()).add(sample_id)
+
+    def _remove(self, sample_id: int):
+        taxonomy = self._taxonomy_of.pop(sample_id, None)
+        if taxonomy is None:
+            return
+
+        parts = split_taxonomy(taxonomy)
+        path = [self._root]
+        for part in parts:
+            path.append(path[-1].children[part])
+
+        ids = path[-1].samples[taxonomy]
+        ids.discard(sample_id)
+        if not ids:
+            del path[-1].samples[taxonomy]
+
+        for node in path:
+            node.count -= 1
+        # Prune branches that no longer hold any sample
+        for parent, part, child in zip(path, parts, path[1:]):
+            if child.count == 0:
+                del parent.children[part]
+                break
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def must_share_trigram(query_length: int, threshold: float) -> bool:
+    """
+    Whether every string with a ratio of at least `threshold` against a query
+    of this length shares a trigram with it. A match of total length T has
+    M >= threshold * T / 2 matched characters in B blocks, and B - 1 <= T - 2M
+    (SequenceMatcher never reports adjacent blocks). A block of k characters
+    holds k - 2 trigrams, so at least M - 2B >= T * (2.5 * threshold - 2) - 2
+    are shared, and T >= 2 * query_length / (2 - threshold) within the length
+    window. Below a threshold of 0.8 this never guarantees one, so there the
+    index cannot prune by trigram; it still scores each distinct string once
+    rather than every sample.
+    """
+    shortest = 2 * query_length / (2 - threshold)
+    return shortest * (2.5 * threshold - 2) - 2 >= 1
+
+
+class TrigramIndex(SampleIndex):
+    # Trigram inverted index over the distinct lower-cased taxonomy strings,
+    # used to pick the candidates ApproximateMatchStrategy has to score
+
+    def __init__(self):
+        super().__init__()
+        self._postings: Dict[str, Set[str]] = {}  # Trigram -> lower-cased taxonomy strings
+        self._variants: Dict[str, Counter] = {}  # Lower-cased taxonomy -> {stored string: sample count}
+
+    def _clear(self):
+        super()._clear()
+        self._postings = {}
+        self._variants = {}
+
+    def search(self, query: str, threshold: float = 0.6,
+               limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Stored taxonomy strings whose SequenceMatcher ratio against the query
+        reaches the threshold, best first. With a limit, only enough strings
+        to cover that many samples are returned, plus every string tied with
+        the last one, so the caller can pick the lowest ids among the ties.
+        """
+        query_lower = query.lower()
+        with self._lock:
+            if not must_share_trigram(len(query_lower), threshold):
+                # Matches may share no trigram, as always below a threshold of
+                # 0.8 (the default is 0.6): every distinct string is scored,
+                # and the length bound in similarity() rejects most cheaply
+                candidates = set(self._variants)
+            else:
+                # Only strings sharing a trigram with the query are scored
+                candidates = set()
+                for gram in trigrams(query_lower):
+                    candidates.update(self._postings.get(gram, ()))
+
+            matcher = SequenceMatcher(None, query_lower)
+            scored = []
+            for candidate in candidates:
+                matcher.set_seq2(candidate)
+                score = similarity(matcher, threshold)
+                if score is not None:
+                    scored.append((score, candidate))
+            scored.sort(key=lambda item: (-item[0], item[1]))
+
+            results = []
+            covered = 0
+            for score, candidate in scored:
+                if limit is not None and covered >= limit and score < results[-1][1]:
+                    break
+                for taxonomy, count in self._variants[candidate].items():
+                    results.append((taxonomy, score))
+                    covered += count
+            return results
+
+    def _insert(self, sample_id: int, taxonomy: str):
+        if taxonomy is None or sample_id in self._taxonomy_of:
+            return
+        self._taxonomy_of[sample_id] = taxonomy
+
+        lower = taxonomy.lower()
+        variants = self._variants.get(lower)
+        if variants is None:
+            variants = self._variants[lower] = Counter()
+            for gram in trigrams(lower):
+                self._postings.setdefault(gram, set()).add(lower)
+        variants[taxonomy] += 1
+
+    def _remove(self, sample_id: int):
+        taxonomy = self._taxonomy_of.pop(sample_id, None)
+        if taxonomy is None:
+            return
+
+        lower = taxonomy.lower()
+        variants = self._variants[lower]
+        variants[taxonomy] -= 1
+        if variants[taxonomy] <= 0:
+            del variants[taxonomy]
+        if not variants:
+            del self._variants[lower]
+            for gram in trigrams(lower):
+                postings = self._postings[gram]
+                postings.discard(lower)
+                if not postings:
+                    del self._postings[gram]
+
+
+trigram_index = TrigramIndex()
\ No newline at end of file
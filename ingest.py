@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from . import diversity, lineage, models, schemas
+from .cache import data_versions
+from .database import begin_write
+
+CHUNK_SIZE = 5000  # Rows validated and committed per transaction
+MAX_REPORTED_ERRORS = 1000
+
+Row = Tuple[int, Dict]  # (1-based row number in the file, raw field values)
+
+FIELDS = tuple(schemas.SampleCreate.model_fields)
+# Bytes that aren't UTF-8 are decoded to lone surrogates, so they fail their row only
+_UNDECODABLE = re.compile("[\udc80-\udcff]")
+
+
+def detect_format(filename: Optional[str]) -> Optional[str]:
+    """Guess the table format from the uploaded file name"""
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return {"tsv": "tsv", "txt": "tsv", "csv": "csv", "biom": "biom", "json": "biom"}.get(extension)
+
+
+def read_delimited(stream, delimiter: str) -> Iterator[Row]:
+    """Rows of a CSV/TSV table with a name, taxonomy, abundance, location header"""
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="surrogateescape", newline="")
+    reader = csv.DictReader(text, delimiter=delimiter)
+    for row_number, row in enumerate(reader, start=1):
+        yield row_number, row
+
+
+def read_biom(stream, default_location: Optional[str] = None) -> Iterator[Row]:
+    """
+    Rows of a BIOM 1.0 style JSON table: one sample per non-zero cell, named
+    after its column, with the OTU's taxonomy metadata and the count turned
+    into relative abundance (%) within the column. The table is parsed up
+    front so a malformed file raises ValueError before anything is inserted.
+    """
+    try:
+        table = json.load(stream)
+        otus = table["rows"]
+        columns = table["columns"]
+        for kind, entries in (("row", otus), ("column", columns)):
+            for i, entry in enumerate(entries):
+                if not isinstance(entry, dict) or not isinstance(entry.get("metadata") or {}, dict):
+                    raise ValueError(f"{kind} {i} must be an object with an object 'metadata'")
+        if table.get("matrix_type") == "dense":
+            cells = [(r, c, value) for r, values in enumerate(table["data"])
+                     for c, value in enumerate(values) if value]
+        else:
+            cells = [(r, c, value) for r, c, value in table["data"] if value]
+
+        totals = [0.0] * len(columns)
+        for r, c, value in cells:
+            if not (isinstance(r, int) and isinstance(c, int) and 0 <= r < len(otus) and 0 <= c < len(columns)):
+                raise ValueError(f"Cell ({r}, {c}) is outside the table")
+            totals[c] += value
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"malformed table ({e!r})")
+    for c in {c for _, c, _ in cells}:
+        if totals[c] <= 0:
+            raise ValueError(f"column {columns[c].get('id')!r} has no positive total to scale to relative abundance")
+
+    def rows() -> Iterator[Row]:
+        for row_number, (r, c, value) in enumerate(cells, start=1):
+            otu_metadata = otus[r].get("metadata") or {}
+            column_metadata = columns[c].get("metadata") or {}
+            taxonomy = otu_metadata.get("taxonomy") or otus[r].get("id")
+            if isinstance(taxonomy, list):
+                taxonomy = ";".join(taxonomy)
+            yield row_number, {
+                "name": columns[c].get("id"),
+                "taxonomy": taxonomy,
+                "abundance": 100.0 * value / totals[c],
+                "location": column_metadata.get("location", default_location),
+            }
+
+    return rows()
+
+
+def _sample(raw: Dict) -> schemas.SampleCreate:
+    # The row's SampleCreate; ValueError (or pydantic's ValidationError) if it's bad
+    extra = raw.get(None)
+    if extra:
+        raise ValueError(f"{len(extra)} more field(s) than the header")
+    fields = {field: raw[field] for field in FIELDS if field in raw}
+    for field, value in fields.items():
+        if isinstance(value, str) and _UNDECODABLE.search(value):
+            raise ValueError(f"{field}: not valid UTF-8")
+    return schemas.SampleCreate(**fields)
+
+
+def bulk_insert(
+    db: Session,
+    user_id: int,
+    rows: Iterable[Row],
+    on_inserted: Optional[Callable[[List[Tuple[int, int, float, str]], int], None]] = None,
+    chunk_size: int = CHUNK_SIZE
+) -> Dict:
+    """
+    Validate rows against SampleCreate and insert the valid ones in chunked
+    transactions. Bad rows are reported, never abort the load. `on_inserted`
+    receives the (id, user_id, abundance, taxonomy) rows of every committed
+    chunk and the global data version that chunk's commit bumped to.
+    """
+    result = {"inserted": 0, "failed": 0, "errors": []}
+
+    def record_error(row_number: int, error: str):
+        result["failed"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"row": row_number, "error": error})
+
+    def flush(values: List[Dict], row_numbers: List[int]):
+        try:
+            begin_write(db)
+            lineage_ids = lineage.lineage_ids(db, {value["taxonomy"] for value in values})
+            for value in values:
+                value["lineage_id"] = lineage_ids[value["taxonomy"]]
+            inserted = db.execute(
+                insert(models.Sample).returning(
+                    models.Sample.id, models.Sample.user_id, models.Sample.abundance, models.Sample.taxonomy),
+                values
+            ).all()
+            diversity.update_alpha(db, [(value["name"], value["location"], user_id, value["lineage_id"],
+                                         value["abundance"]) for value in values])
+            version = data_versions.bump(db, [user_id])
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            for row_number in row_numbers:
+                record_error(row_number, f"Database error: {e.__class__.__name__}")
+            return
+        result["inserted"] += len(inserted)
+        if on_inserted:
+            on_inserted([tuple(row) for row in inserted], version)
+
+    values, row_numbers = [], []
+    for row_number, raw in rows:
+        try:
+            sample = _sample(raw)
+        except ValidationError as e:
+            record_error(row_number, "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()))
+            continue
+        except ValueError as e:
+            record_error(row_number, str(e))
+            continue
+        values.append(dict(sample.model_dump(), user_id=user_id))
+        row_numbers.append(row_number)
+        if len(values) >= chunk_size:
+            flush(values, row_numbers)
+            values, row_numbers = [], []
+    if values:
+        flush(values, row_numbers)
+
+    return result
\ No newline at end of file
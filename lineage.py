@@ -0,0 +1,88 @@
+"""
+Normalized taxonomy storage. Every distinct taxonomy string gets one
+`lineages` row with per-rank columns, and samples point at it through
+`samples.lineage_id`, so rank and substring filters run against the small
+table of distinct strings and reach the samples through an index.
+
+Existing databases are upgraded at startup; to run the backfill alone:
+
+    python -m app.lineage
+"""
+from typing import Dict, Iterable
+from sqlalchemy import bindparam, inspect, select, text, update
+from sqlalchemy.orm import Session
+from . import models
+from .database import insert_ignoring_conflicts
+from .index import split_taxonomy
+
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def lineage_values(taxonomy: str) -> Dict:
+    """Column values of the Lineage row for one taxonomy string"""
+    parts = split_taxonomy(taxonomy)
+    values = {"taxonomy": taxonomy, "taxonomy_lower": taxonomy.lower()}
+    for i, rank in enumerate(models.LINEAGE_RANKS):
+        values[rank] = parts[i] if i < len(parts) else None
+    return values
+
+
+def _insert_missing(db: Session):
+    # Concurrent writers may race to add the same string; let the loser skip it
+    return insert_ignoring_conflicts(db, models.Lineage, ["taxonomy"])
+
+
+def _existing(db: Session, taxonomies) -> Dict[str, int]:
+    rows = db.execute(select(models.Lineage.taxonomy, models.Lineage.id).where(models.Lineage.taxonomy.in_(
+        bindparam("taxonomies", list(taxonomies), expanding=True, literal_execute=True))))
+    return dict(rows.all())
+
+
+def lineage_ids(db: Session, taxonomies: Iterable[str]) -> Dict[str, int]:
+    """Lineage id per taxonomy string, creating the missing rows (not committed)"""
+    wanted = set(taxonomies)
+    if not wanted:
+        return {}
+    ids = _existing(db, wanted)
+    missing = wanted.difference(ids)
+    if missing:
+        db.execute(_insert_missing(db), [lineage_values(taxonomy) for taxonomy in missing])
+        ids.update(_existing(db, missing))
+    return ids
+
+
+def backfill(db: Session, chunk_size: int = BACKFILL_CHUNK_SIZE) -> int:
+    """Link samples written before the lineage table existed; returns the count"""
+    done = 0
+    while True:
+        rows = db.execute(
+            select(models.Sample.id, models.Sample.taxonomy)
+            .where(models.Sample.lineage_id.is_(None), models.Sample.taxonomy.is_not(None))
+            .order_by(models.Sample.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return done
+        ids = lineage_ids(db, {taxonomy for _, taxonomy in rows})
+        db.execute(update(models.Sample), [{"id": sample_id, "lineage_id": ids[taxonomy]}
+                                           for sample_id, taxonomy in rows])
+        db.commit()
+        done += len(rows)
+
+
+def migrate(engine) -> int:
+    """Add samples.lineage_id to an older database, then backfill it"""
+    columns = {column["name"] for column in inspect(engine).get_columns("samples")}
+    if "lineage_id" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE samples ADD COLUMN lineage_id INTEGER REFERENCES lineages(id)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_samples_lineage_id ON samples (lineage_id)"))
+    with Session(engine) as db:
+        return backfill(db)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    print(f"Linked {migrate(engine)} samples to their lineage")
\ No newline at end of file
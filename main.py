@@ -1,9 +1,12 @@
 import streamlit as st
 import requests
 import pandas as pd
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout
 
 API_URL = "http://127.0.0.1:8000"
+PAGE_SIZES = [25, 50, 100, 250]
+SEARCH_LIMIT = 1000  # Most search results fetched and shown at once
 
 # Initialize session state
 if "logged_in" not in st.session_state:
@@ -12,21 +15,85 @@ if "username" not in st.session_state:
     st.session_state.username = None
 if "user_id" not in st.session_state:
     st.session_state.user_id = None
+if "token" not in st.session_state:
+    st.session_state.token = None  # Session token from /login, sent with every write
+if "page_cursors" not in st.session_state:
+    st.session_state.page_cursors = [None]  # `after` cursor of every page visited so far
+
+
+@st.cache_resource
+def get_http():
+    """One keep-alive session shared by every rerun and browser tab"""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+
+http = get_http()
+
+
+def auth_headers():
+    """Authorization header carrying the logged-in user's session token"""
+    return {"Authorization": f"Bearer {st.session_state.token}"}
+
+
+def error_detail(response, default="Unknown error"):
+    """The `detail` of an API error response, or its text when the body is not JSON"""
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text.strip() or f"{default} (HTTP {response.status_code})"
+    return body.get("detail", default) if isinstance(body, dict) else default
+
+
+class SearchError(Exception):
+    """The API answered a search with an error; raised so st.cache_data keeps no copy of it"""
 
 
 def check_api_connection():
-    """Check if API is running"""
+    """Check if API is running; returns the server's data version, or None"""
     try:
-        response = requests.get(f"{API_URL}/docs", timeout=2)
-        return True
+        response = http.get(f"{API_URL}/health", timeout=2)
+        return response.json()["data_version"]
     except:
-        return False
+        return None
+
+
+# Responses are cached per user and data version: any write on the server
+# changes the version, so a stale page is never served
+@st.cache_data(max_entries=256, show_spinner=False)
+def fetch_samples_page(user_id, after, limit, data_version):
+    params = {"limit": limit}
+    if after is not None:
+        params["after"] = after
+    response = http.get(f"{API_URL}/samples/user/{user_id}", params=params, timeout=10)
+    response.raise_for_status()
+    return response.json(), response.headers.get("X-Next-Cursor")
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def fetch_search(query, strategy, min_abundance, max_abundance, data_version):
+    response = http.get(
+        f"{API_URL}/search",
+        params={
+            "query": query,
+            "strategy": strategy,
+            "min_abundance": min_abundance,
+            "max_abundance": max_abundance,
+            "limit": SEARCH_LIMIT
+        },
+        timeout=30
+    )
+    if response.status_code != 200:
+        raise SearchError(error_detail(response))
+    return response.json()
 
 st.set_page_config(page_title="Microbiome Taxonomy Browser", layout="wide")
 st.title("Microbiome Taxonomy Browser")
 
 # Check API connection
-if not check_api_connection():
+data_version = check_api_connection()
+if data_version is None:
     st.error("Cannot connect to FastAPI backend! Make sure it's running on http://127.0.0.1:8000")
     st.info("Run: `uvicorn app.api:app --reload` in your terminal")
     st.stop()
@@ -45,7 +112,7 @@ with st.sidebar:
             if st.button("Register", use_container_width=True):
                 if username and password:
                     try:
-                        response = requests.post(
+                        response = http.post(
                             f"{API_URL}/users/", 
                             json={"username": username, "password": password},
                             timeout=5
@@ -53,7 +120,7 @@ with st.sidebar:
                         if response.status_code == 200:
                             st.success("Registered! Please login.")
                         else:
-                            st.error(response.json().get("detail", "Error"))
+                            st.error(error_detail(response, "Error"))
                     except ConnectionError:
                         st.error("Cannot connect to API. Is FastAPI running?")
                     except Exception as e:
@@ -65,7 +132,7 @@ with st.sidebar:
             if st.button("Login", use_container_width=True):
                 if username and password:
                     try:
-                        response = requests.post(
+                        response = http.post(
                             f"{API_URL}/login",
                             json={"username": username, "password": password},
                             timeout=5
@@ -75,6 +142,7 @@ with st.sidebar:
                             st.session_state.logged_in = True
                             st.session_state.username = data["username"]
                             st.session_state.user_id = data["user_id"]
+                            st.session_state.token = data["token"]
                             st.success("Login successful!")
                             st.rerun()
                         else:
@@ -92,6 +160,8 @@ with st.sidebar:
             st.session_state.logged_in = False
             st.session_state.username = None
             st.session_state.user_id = None
+            st.session_state.token = None
+            st.session_state.page_cursors = [None]
             st.rerun()
 
 # Main content
@@ -104,37 +174,57 @@ else:
     with tab1:
         st.header("My Microbiome Samples")
         
+        # One page at a time, walked with the server's keyset cursor
+        page_size = st.selectbox("Samples per page", PAGE_SIZES, key="page_size",
+                                 on_change=lambda: st.session_state.update(page_cursors=[None]))
+        cursors = st.session_state.page_cursors
+        page = len(cursors) - 1
+        
         try:
-            response = requests.get(f"{API_URL}/samples/user/{st.session_state.user_id}")
-            if response.status_code == 200:
-                samples = response.json()
+            samples, next_cursor = fetch_samples_page(st.session_state.user_id, cursors[-1], page_size, data_version)
+            
+            if samples:
+                for sample in samples:
+                    with st.expander(f" {sample['name']}", expanded=False):
+                        col1, col2 = st.columns([3, 1])
+                        
+                        with col1:
+                            st.write(f"**Taxonomy:** {sample['taxonomy']}")
+                            st.write(f"**Abundance:** {sample['abundance']:.2f}%")
+                            st.write(f"**Location:** {sample['location']}")
+                        
+                        with col2:
+                            if st.button(" Delete", key=f"del_{sample['id']}"):
+                                del_response = http.delete(
+                                    f"{API_URL}/samples/{sample['id']}",
+                                    headers=auth_headers(),
+                                    timeout=5
+                                )
+                                if del_response.status_code == 200:
+                                    st.success("Deleted!")
+                                    st.rerun()
                 
-                if samples:
-                    for sample in samples:
-                        with st.expander(f" {sample['name']}", expanded=False):
-                            col1, col2 = st.columns([3, 1])
-                            
-                            with col1:
-                                st.write(f"**Taxonomy:** {sample['taxonomy']}")
-                                st.write(f"**Abundance:** {sample['abundance']:.2f}%")
-                                st.write(f"**Location:** {sample['location']}")
-                            
-                            with col2:
-                                if st.button(" Delete", key=f"del_{sample['id']}"):
-                                    del_response = requests.delete(
-                                        f"{API_URL}/samples/{sample['id']}",
-                                        params={"user_id": st.session_state.user_id}
-                                    )
-                                    if del_response.status_code == 200:
-                                        st.success("Deleted!")
-                                        st.rerun()
-                    
-                    # Table view
-                    st.subheader("Sample Table")
-                    df = pd.DataFrame(samples)
-                    st.dataframe(df[['name', 'taxonomy', 'abundance', 'location']], use_container_width=True)
-                else:
-                    st.info("No samples yet. Add your first sample!")
+                # Table view
+                st.subheader("Sample Table")
+                df = pd.DataFrame(samples)
+                st.dataframe(df[['name', 'taxonomy', 'abundance', 'location']], use_container_width=True)
+            elif page == 0:
+                st.info("No samples yet. Add your first sample!")
+            else:
+                st.info("No more samples.")
+            
+            if page > 0 or next_cursor is not None:
+                col_prev, col_page, col_next = st.columns([1, 2, 1])
+                with col_prev:
+                    if st.button("Previous", disabled=page == 0, use_container_width=True):
+                        cursors.pop()
+                        st.rerun()
+                with col_page:
+                    st.caption(f"Page {page + 1}")
+                with col_next:
+                    if st.button("Next", disabled=next_cursor is None, use_container_width=True):
+                        cursors.append(int(next_cursor))
+                        st.rerun()
         except Exception as e:
             st.error(f"Error loading samples: {e}")
     
@@ -158,9 +248,9 @@ else:
             if submitted:
                 if sample_name and taxonomy and location:
                     try:
-                        response = requests.post(
+                        response = http.post(
                             f"{API_URL}/samples/",
-                            params={"user_id": st.session_state.user_id},
+                            headers=auth_headers(),
                             json={
                                 "name": sample_name,
                                 "taxonomy": taxonomy,
@@ -172,8 +262,7 @@ else:
                         if response.status_code == 200:
                             st.success("Sample added!")
                         else:
-                            error_detail = response.json().get("detail", "Unknown error")
-                            st.error(f"Failed to add sample: {error_detail}")
+                            st.error(f"Failed to add sample: {error_detail(response)}")
                             st.error(f"Status code: {response.status_code}")
                     except ConnectionError:
                         st.error("Cannot connect to API")
@@ -191,12 +280,13 @@ else:
         # Strategy selector
         strategy = st.selectbox(
             "Select Search Strategy:",
-            ["exact", "approximate", "hierarchical", "abundance"],
+            ["exact", "approximate", "hierarchical", "abundance", "fulltext"],
             format_func=lambda x: {
                 "exact": "Exact Match",
                 "approximate": "Approximate Match", 
                 "hierarchical": "Hierarchical Match",
-                "abundance": "Abundance Filter"
+                "abundance": "Abundance Filter",
+                "fulltext": "Full-Text Search"
             }[x],
             help="Each strategy uses a different algorithm to find samples"
         )
@@ -218,43 +308,28 @@ else:
             if search_query or strategy == "abundance":
                 try:
                     # Single API endpoint with strategy parameter
-                    response = requests.get(
-                        f"{API_URL}/search",
-                        params={
-                            "query": search_query,
-                            "strategy": strategy,
-                            "min_abundance": min_abundance,
-                            "max_abundance": max_abundance
-                        }
-                    )
+                    results = fetch_search(search_query, strategy, min_abundance, max_abundance, data_version)
                     
-                    if response.status_code == 200:
-                        results = response.json()
+                    if results:
+                        strategy_name = {
+                            "exact": "Exact Match",
+                            "approximate": "Approximate Match",
+                            "hierarchical": "Hierarchical Match",
+                            "abundance": "Abundance Filter",
+                            "fulltext": "Full-Text Search"
+                        }[strategy]
                         
-                        if results:
-                            strategy_name = {
-                                "exact": "Exact Match",
-                                "approximate": "Approximate Match",
-                                "hierarchical": "Hierarchical Match",
-                                "abundance": "Abundance Filter"
-                            }[strategy]
-                            
-                            st.success(f"Found {len(results)} samples using **{strategy_name}**")
-                            
-                            for sample in results:
-                                with st.container():
-                                    col1, col2, col3 = st.columns(3)
-                                    with col1:
-                                        st.markdown(f"**{sample['name']}**")
-                                    with col2:
-                                        st.write(f"Taxonomy: {sample['taxonomy']}")
-                                    with col3:
-                                        st.write(f"Abundance: {sample['abundance']:.2f}%")
-                                    st.divider()
-                        else:
-                            st.info("No samples found")
+                        shown = f"the first {SEARCH_LIMIT}" if len(results) == SEARCH_LIMIT else len(results)
+                        st.success(f"Found {shown} samples using **{strategy_name}**")
+                        
+                        # A dataframe only renders the rows in view, however many there are
+                        df = pd.DataFrame(results)
+                        st.dataframe(df[['name', 'taxonomy', 'abundance', 'location']],
+                                     use_container_width=True, hide_index=True)
                     else:
-                        st.error(f"Search failed: {response.json().get('detail', 'Unknown error')}")
+                        st.info("No samples found")
+                except SearchError as e:
+                    st.error(f"Search failed: {e}")
                 except Exception as e:
                     st.error(f"Search error: {e}")
             else:
@@ -0,0 +1,189 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+
+# Latency buckets in seconds, 0.5 ms up to 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+# Per-request profile (phase -> [seconds, count]); set only for requests that ask for it
+_profile: ContextVar[Optional[Dict[str, list]]] = ContextVar("profile", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], list] = {}  # labels -> [per-bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=bound))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le='+Inf'))} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {entry[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {entry[-1]}")
+        return lines
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route template",
+    ["method", "route", "status"])
+SEARCH_PHASE_DURATION = Histogram(
+    "search_phase_duration_seconds", "Time spent per /search phase (filter, fetch, refine, serialize)",
+    ["strategy", "phase"])
+SEARCH_ROWS_SCANNED = Counter(
+    "search_rows_scanned_total", "Rows fetched from the database and handed to a strategy", ["strategy"])
+SEARCH_ROWS_RETURNED = Counter(
+    "search_rows_returned_total", "Rows returned by a strategy", ["strategy"])
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ["operation"])
+
+
+def render(extra: Sequence[str] = ()) -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+
+def render_values(name: str, kind: str, documentation: str, values: Dict[str, float]) -> List[str]:
+    """Exposition lines for values kept elsewhere (e.g. SearchCache counters)"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for label, value in values.items():
+        lines.append(f'{name}{{kind="{_escape(label)}"}} {value}')
+    return lines
+
+
+def _record_profile(phase: str, seconds: float):
+    profile = _profile.get()
+    if profile is not None:
+        entry = profile.setdefault(phase, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def timed(strategy: str, phase: str):
+    """Time one /search phase into the histogram and the request profile"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SEARCH_PHASE_DURATION.observe(elapsed, strategy=strategy, phase=phase)
+        _record_profile(phase, elapsed)
+
+
+def start_profile(enabled: bool):
+    return _profile.set({} if enabled else None)
+
+
+def current_profile() -> Optional[Dict[str, list]]:
+    return _profile.get()
+
+
+def end_profile(token):
+    _profile.reset(token)
+
+
+def server_timing(profile: Dict[str, list], total: float) -> str:
+    """Server-Timing header value for a profiled request"""
+    entries = [f'{phase};dur={seconds * 1000:.2f};desc="{count}x"'
+               for phase, (seconds, count) in profile.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def instrument_engine(engine):
+    """Count and time every SQL statement run through an engine"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_DURATION.observe(elapsed, operation=operation)
+        _record_profile("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
\ No newline at end of file
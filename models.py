@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -25,6 +25,68 @@ class Sample(Base):
     abundance = Column(Float)  # Relative abundance (0-100%)
     location = Column(String)  # Sample location/source
     user_id = Column(Integer, ForeignKey("users.id"))
+    lineage_id = Column(Integer, ForeignKey("lineages.id"), index=True)  # Parsed form of `taxonomy`
     
     # Relationship to user
-    owner = relationship("User", back_populates="samples")
\ No newline at end of file
+    owner = relationship("User", back_populates="samples")
+
+
+# Rank columns of Lineage, outermost first
+LINEAGE_RANKS = ("domain", "phylum", "class_", "order", "family", "genus", "species")
+
+
+class Lineage(Base):
+    """One distinct taxonomy string, split into lower-cased rank columns"""
+    __tablename__ = "lineages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    taxonomy = Column(String, unique=True, nullable=False)  # As written by the samples
+    taxonomy_lower = Column(String, index=True)
+    # Trimmed, lower-cased ranks; NULL past the end of a shorter taxonomy
+    domain = Column(String, index=True)
+    phylum = Column(String, index=True)
+    class_ = Column("class", String, index=True)
+    order = Column(String, index=True)
+    family = Column(String, index=True)
+    genus = Column(String, index=True)
+    species = Column(String, index=True)
+
+
+# Sample groupings with a maintained alpha-diversity summary
+DIVERSITY_GROUPS = ("name", "location", "user_id")
+
+
+class GroupTaxon(Base):
+    """Summed abundance of one lineage within a sample group"""
+    __tablename__ = "group_taxa"
+    __table_args__ = (UniqueConstraint("kind", "value", "lineage_id"),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # One of DIVERSITY_GROUPS
+    value = Column(String, nullable=False)  # The group's name, location or user id
+    lineage_id = Column(Integer, ForeignKey("lineages.id"), nullable=False)
+    abundance = Column(Float, nullable=False, default=0.0)
+    samples = Column(Integer, nullable=False, default=0)
+
+
+class GroupDiversity(Base):
+    """Running sums of a sample group from which Shannon and Simpson follow directly"""
+    __tablename__ = "group_diversity"
+    __table_args__ = (UniqueConstraint("kind", "value"),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+    samples = Column(Integer, nullable=False, default=0)
+    richness = Column(Integer, nullable=False, default=0)  # Lineages with abundance > 0
+    total_abundance = Column(Float, nullable=False, default=0.0)  # A = sum(a)
+    sum_a_log_a = Column(Float, nullable=False, default=0.0)  # sum(a * ln a), over lineages
+    sum_a_squared = Column(Float, nullable=False, default=0.0)  # sum(a^2), over lineages
+
+
+class DataVersion(Base):
+    """Change counter of the sample data, bumped by every write: row 0 for all samples, one row per user"""
+    __tablename__ = "data_versions"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(BigInteger, nullable=False)
\ No newline at end of file
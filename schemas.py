@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from typing import List, Optional, Union
 
 
 class UserCreate(BaseModel):
@@ -30,4 +31,62 @@ class SampleOut(BaseModel):
     user_id: int
     
     class Config:
-        from_attributes = True  # Updated for Pydantic V2
\ No newline at end of file
+        from_attributes = True  # Updated for Pydantic V2
+
+
+class TaxonomyNodeOut(BaseModel):
+    name: str
+    count: int
+
+
+class RollupOut(BaseModel):
+    taxonomy: str  # First `depth` ranks
+    group: Optional[Union[int, str]] = None  # Location or user id when grouped
+    samples: int
+    total_abundance: float
+    mean_abundance: float
+
+
+class BatchQuery(BaseModel):
+    query: str
+    strategy: str = "exact"
+    min_abundance: float = 0.0
+    max_abundance: float = 100.0
+    threshold: float = Field(0.6, ge=0, le=1)  # For "approximate"
+    limit: Optional[int] = Field(None, ge=1)
+    key: Optional[str] = None  # Result key; defaults to the query
+
+
+class BatchSearchIn(BaseModel):
+    queries: List[BatchQuery] = Field(..., max_length=1000)
+
+
+class AlphaDiversityOut(BaseModel):
+    group: str
+    samples: int
+    richness: int  # Distinct lineages with abundance > 0
+    total_abundance: float
+    shannon: float  # Natural log
+    simpson: float  # Gini-Simpson, 1 - sum(p^2)
+
+
+class RowError(BaseModel):
+    row: int
+    error: str
+
+
+class BulkIngestOut(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[RowError]  # First errors only, capped for very bad files
+
+
+class CacheStatsOut(BaseModel):
+    size: int
+    maxsize: int
+    ttl: float
+    generation: int
+    hits: int
+    misses: int
+    evictions: int
+    expired: int
\ No newline at end of file
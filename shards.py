@@ -0,0 +1,189 @@
+"""
+Sharded search over worker processes.
+
+The samples are split into shards of consecutive id ranges. Each shard
+lives in its own long-lived worker process as a ColumnarSnapshot of just
+its rows, so a query runs on every shard at once, one core per shard, and
+the per-shard results are merged: concatenated in id order, or by score
+for ranked strategies. Writes are queued per shard and shipped ahead of
+the next query; each worker runs its tasks in order, so a query always
+sees the writes made before it. New ids land in the last shard, and once
+one shard grows well past an even share, or writes through other API
+workers have made the shards stale, they are rebuilt from the table.
+"""
+import heapq
+import multiprocessing
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+from typing import List, Optional, Tuple
+from sqlalchemy import func, select
+from . import models
+from .cache import LoadedVersion
+from .columnar import ColumnarSnapshot, np
+
+# Rebuild once the largest shard holds this many times an even share...
+REBALANCE_FACTOR = 1.5
+# ...and at least this many rows
+REBALANCE_MIN_ROWS = 10000
+# Pools start from request threads, and a forked child would inherit locks
+# other threads happen to hold; forkserver children start from a clean process
+POOL_CONTEXT = multiprocessing.get_context("forkserver")
+
+_shard: Optional[ColumnarSnapshot] = None  # Inside a worker: the rows of its shard
+
+
+def _load_shard(rows: List[Tuple[int, int, float, str]]):
+    global _shard
+    _shard = ColumnarSnapshot()
+    _shard.load_rows(rows)
+
+
+def _update_shard(changes: List[Tuple[int, Optional[tuple]]]):
+    # (id, (user_id, abundance, taxonomy)) adds a sample, (id, None) removes it
+    for sample_id, row in changes:
+        if row is None:
+            _shard.remove(sample_id)
+        else:
+            _shard.add(sample_id, *row)
+
+
+def _search_shard(strategy, query: str, after: Optional[int], limit: Optional[int]) -> list:
+    # Ids of the shard's matches in id order, or (-score, id) best first when ranked
+    if strategy.ranked:
+        prepared = strategy.prepare(query)
+        return _shard.ranked_ids(lambda taxonomy: strategy.score(prepared, taxonomy), limit)
+    return _shard.select(lambda: strategy.column_mask(query, _shard), after, limit)
+
+
+class ShardedSearch:
+    # Shard layout and pending writes on the serving side. Each shard has a
+    # one-process pool, which keeps its rows resident and runs its tasks in
+    # submission order.
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.enabled = shards > 1 and np is not None
+        self._loaded = False
+        self._version = LoadedVersion()
+        self._lock = threading.RLock()
+        self._pools: List[ProcessPoolExecutor] = []
+        self._starts: List[int] = []  # First id of each shard
+        self._sizes: List[int] = []
+        self._pending: List[list] = []  # Per shard, changes not yet sent
+
+    @property
+    def loaded(self) -> bool:
+        # False again once the shards need rebuilding, so the next load() does it
+        with self._lock:
+            return self._loaded and not self._unbalanced()
+
+    def current(self, version: int) -> bool:
+        """Whether the shards are balanced and hold every write up to the global data `version`"""
+        with self._lock:
+            return self.loaded and self._version.covers(version)
+
+    def load(self, db, version: Optional[int] = None):
+        """
+        (Re)build the shards from the samples table, an even id range per
+        worker: when unbalanced, or given the global data `version` read
+        before, until they hold every write up to it
+        """
+        with self._lock:
+            if self.loaded and (version is None or self._version.covers(version)):
+                return
+            while len(self._pools) < self.shards:
+                self._pools.append(ProcessPoolExecutor(max_workers=1, mp_context=POOL_CONTEXT))
+            total = db.scalar(select(func.count()).select_from(models.Sample))
+            size = max(1, -(-total // self.shards))
+            rows = db.query(models.Sample.id, models.Sample.user_id, models.Sample.abundance,
+                            models.Sample.taxonomy).order_by(models.Sample.id).yield_per(50000)
+
+            starts, sizes, chunk = [], [], []
+            for row in rows:
+                if not starts or (len(chunk) >= size and len(starts) < self.shards):
+                    if starts:
+                        self._pools[len(starts) - 1].submit(_load_shard, chunk)
+                    starts.append(row[0])
+                    sizes.append(0)
+                    chunk = []
+                chunk.append(tuple(row))
+                sizes[-1] += 1
+            if starts:
+                self._pools[len(starts) - 1].submit(_load_shard, chunk)
+            # Shards past the end of the data start empty; new ids go to the last one
+            for pool in self._pools[len(starts):]:
+                pool.submit(_load_shard, [])
+            next_id = chunk[-1][0] + 1 if chunk else 0
+            sizes += [0] * (self.shards - len(starts))
+            starts += [next_id] * (self.shards - len(starts))
+
+            self._starts, self._sizes = starts, sizes
+            self._pending = [[] for _ in range(self.shards)]
+            self._loaded = True
+            self._version.value = version
+
+    def add(self, sample_id: int, user_id: int, abundance: float, taxonomy: str):
+        with self._lock:
+            if self._loaded:
+                shard = self._shard_of(sample_id)
+                self._pending[shard].append((sample_id, (user_id, abundance, taxonomy)))
+                self._sizes[shard] += 1
+
+    def remove(self, sample_id: int):
+        with self._lock:
+            if self._loaded:
+                shard = self._shard_of(sample_id)
+                self._pending[shard].append((sample_id, None))
+                self._sizes[shard] = max(0, self._sizes[shard] - 1)
+
+    def written(self, version: int):
+        """The writes that bumped the global data version to `version` were added or removed"""
+        with self._lock:
+            self._version.written(version)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(self._sizes)
+
+    def search_ids(self, strategy, query: str, after: Optional[int] = None,
+                   limit: Optional[int] = None) -> List[int]:
+        """
+        Ids of the samples `strategy` matches, across all shards: in id order
+        after the cursor, or best first for ranked strategies; up to `limit`.
+        The strategy is pickled to the workers, so it must not hold an index.
+        """
+        with self._lock:
+            for pool, changes in zip(self._pools, self._pending):
+                if changes:
+                    pool.submit(_update_shard, changes)
+            self._pending = [[] for _ in self._pools]
+            futures = [pool.submit(_search_shard, strategy, query, after, limit) for pool in self._pools]
+        try:
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            with self._lock:  # A worker died; start over from the table on the next load()
+                for pool in self._pools:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                self._loaded = False
+                self._pools = []
+            raise
+
+        if strategy.ranked:
+            merged = (sample_id for _, sample_id in heapq.merge(*results))
+        else:
+            merged = chain.from_iterable(results)  # Shards are consecutive id ranges
+        return list(islice(merged, limit))
+
+    def _shard_of(self, sample_id: int) -> int:
+        return max(0, bisect_right(self._starts, sample_id) - 1)
+
+    def _unbalanced(self) -> bool:
+        largest = max(self._sizes, default=0)
+        return largest >= REBALANCE_MIN_ROWS and largest > REBALANCE_FACTOR * sum(self._sizes) / self.shards
+
+
+sharded_search = ShardedSearch(shards=int(os.getenv("SEARCH_SHARDS", "0")))
\ No newline at end of file
@@ -1,76 +1,279 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List
-from . import models
+from concurrent.futures import Executor
+from difflib import SequenceMatcher
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import bindparam, false, func, select
+from . import fulltext, metrics, models
+
+
+def _like_escape(text: str) -> str:
+    # Escape LIKE wildcards so user input is matched literally
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _lineage_matches(*criteria):
+    # Samples whose Lineage row meets `criteria`: the filter runs over the distinct
+    # taxonomy strings, and the samples are reached through the lineage_id index
+    return models.Sample.lineage_id.in_(select(models.Lineage.id).where(*criteria))
+
+
+@lru_cache(maxsize=65536)
+def normalize_taxonomy(taxonomy: str) -> Tuple[str, Tuple[str, ...]]:
+    # Lower-cased form and stripped ranks of a taxonomy string, memoized across queries
+    lower = taxonomy.lower()
+    return lower, tuple(part.strip() for part in lower.split(';'))
+
+
+def similarity(matcher: SequenceMatcher, threshold: float) -> Optional[float]:
+    # The matcher's ratio() when it reaches `threshold`, else None. The cheap
+    # upper bounds go first, so most misses never pay for the full ratio.
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return None
+    ratio = matcher.ratio()
+    return ratio if ratio >= threshold else None
 
 
 class SearchStrategy(ABC):
     # Abstract base class for search strategies
     
+    name = "custom"  # Label used in metrics
+    # True when sql_filter() alone decides the result, so search() can be skipped
+    exact_in_sql = False
+    # True when results are ordered by score rather than by id, so they can
+    # neither be paged by id nor refined batch by batch
+    ranked = False
+    # True when sql_filter() itself does real work (e.g. scoring an index),
+    # so async callers should run it off the event loop
+    cpu_heavy = False
+    
     @abstractmethod
-    def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
+    def matches(self, prepared, taxonomy: str) -> bool:
+        # Verdict for one distinct taxonomy string; `prepared` comes from prepare()
         pass
+    
+    def prepare(self, query: str):
+        # Query form shared by every matches() call of one search
+        return query.lower()
+    
+    def score(self, prepared, taxonomy: str) -> Optional[float]:
+        # Rank of one distinct taxonomy string, higher first (None = no match);
+        # lets ranked results computed in pieces be merged
+        return 1.0 if self.matches(prepared, taxonomy) else None
+    
+    def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
+        # Samples sharing a taxonomy string share the verdict, so each distinct
+        # string is evaluated once and the result fanned out to its samples
+        prepared = self.prepare(query)
+        verdicts: Dict[str, bool] = {}
+        results = []
+        
+        for sample in samples:
+            taxonomy = sample.taxonomy
+            verdict = verdicts.get(taxonomy)
+            if verdict is None:
+                verdict = verdicts[taxonomy] = self.matches(prepared, taxonomy)
+            if verdict:
+                results.append(sample)
+        
+        return results
+    
+    def sql_filter(self, query: str):
+        # SQL predicate that narrows the Sample rows to fetch (None = no pushdown)
+        return None
+    
+    def sql_order(self, query: str):
+        # ORDER BY expression for ranked strategies that SQL can rank (None = unordered)
+        return None
+    
+    def column_mask(self, query: str, snapshot):
+        # Boolean mask over a ColumnarSnapshot's rows; one verdict per distinct taxonomy
+        prepared = self.prepare(query)
+        return snapshot.taxonomy_mask(lambda taxonomy: self.matches(prepared, taxonomy))
 
 
 class ExactMatchStrategy(SearchStrategy):
     # Search for exact matches in taxonomy
     
-    def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
-        query_lower = query.lower()
-        return [s for s in samples if query_lower in s.taxonomy.lower()]
+    name = "exact"
+    exact_in_sql = True
+    
+    def matches(self, prepared: str, taxonomy: str) -> bool:
+        return prepared in normalize_taxonomy(taxonomy)[0]
+    
+    def sql_filter(self, query: str):
+        return _lineage_matches(models.Lineage.taxonomy_lower.contains(query.lower(), autoescape=True))
 
 
 class ApproximateMatchStrategy(SearchStrategy):
     # Search using approximate matching (allows small differences)
     
+    name = "approximate"
+    ranked = True
+    cpu_heavy = True
+    
+    def __init__(self, threshold: float = 0.6, limit: Optional[int] = None, index=None):
+        self.threshold = threshold  # Similarity threshold
+        self.limit = limit  # Keep only the best `limit` samples
+        self.index = index  # Optional TrigramIndex used to pick candidates
+        self._scores = None  # Taxonomy -> similarity, filled by sql_filter() when indexed
+    
+    def matches(self, prepared: str, taxonomy: str) -> bool:
+        return self.score(prepared, taxonomy) is not None
+    
+    def score(self, prepared: str, taxonomy: str) -> Optional[float]:
+        return similarity(SequenceMatcher(None, prepared, normalize_taxonomy(taxonomy)[0]), self.threshold)
+    
     def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
-        from difflib import SequenceMatcher
+        scores = self._scores
+        if scores is None:
+            # Score each distinct taxonomy once
+            prepared = self.prepare(query)
+            scores = {}
+            for taxonomy in {s.taxonomy for s in samples}:
+                score = self.score(prepared, taxonomy)
+                if score is not None:
+                    scores[taxonomy] = score
         
-        query_lower = query.lower()
-        threshold = 0.6  # Similarity threshold
-        results = []
+        scored = [(scores[s.taxonomy], s) for s in samples if s.taxonomy in scores]
         
-        for sample in samples:
-            similarity = SequenceMatcher(None, query_lower, sample.taxonomy.lower()).ratio()
-            if similarity >= threshold:
-                results.append(sample)
+        # Best matches first, by id among equals as the sharded merge orders them
+        scored.sort(key=lambda item: (-item[0], item[1].id))
+        results = [sample for _, sample in scored]
+        return results if self.limit is None else results[:self.limit]
+    
+    def sql_filter(self, query: str):
+        if self.index is not None:
+            self._scores = dict(self.index.search(query, self.threshold, self.limit))
+            if not self._scores:
+                return false()
+            return models.Sample.taxonomy.in_(
+                bindparam("taxonomies", list(self._scores), expanding=True, literal_execute=True))
         
-        return results
+        # ratio() can never exceed 2 * min(len) / (len_a + len_b), so strings whose
+        # length is too far from the query's can be dropped before scoring
+        if not query or self.threshold <= 0:
+            return None
+        length = len(query)
+        low = length * self.threshold / (2 - self.threshold)
+        high = length * (2 - self.threshold) / self.threshold
+        return func.length(models.Sample.taxonomy).between(low, high)
 
 
 class HierarchicalMatchStrategy(SearchStrategy):
    # Search by taxonomic hierarchy (Bacteria;Proteobacteria;Gammaproteobacteria)
     
-    def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
-        query_parts = [part.strip().lower() for part in query.split(';')]
-        results = []
+    name = "hierarchical"
+    
+    def prepare(self, query: str):
+        return normalize_taxonomy(query)[1]
+    
+    def matches(self, prepared: Tuple[str, ...], taxonomy: str) -> bool:
+        taxonomy_parts = normalize_taxonomy(taxonomy)[1]
         
-        for sample in samples:
-            taxonomy_parts = [part.strip().lower() for part in sample.taxonomy.split(';')]
-            
-            # Check if query parts match the beginning of taxonomy hierarchy
-            if len(query_parts) <= len(taxonomy_parts):
-                if all(q in t for q, t in zip(query_parts, taxonomy_parts)):
-                    results.append(sample)
+        # Check if query parts match the beginning of taxonomy hierarchy
+        if len(prepared) <= len(taxonomy_parts):
+            return all(q in t for q, t in zip(prepared, taxonomy_parts))
+        return False
+    
+    def sql_filter(self, query: str):
+        query_parts = [part.strip().lower() for part in query.split(';')]
+        # Each part can be checked against its own rank column, which decides
+        # the match outright; only queries deeper than the columns need search()
+        self.exact_in_sql = len(query_parts) <= len(models.LINEAGE_RANKS)
+        if self.exact_in_sql:
+            return _lineage_matches(*(getattr(models.Lineage, rank).contains(part, autoescape=True)
+                                      for rank, part in zip(models.LINEAGE_RANKS, query_parts)))
         
-        return results
+        # Every match contains the query parts in order, separated by ';'.
+        # LIKE can't pin each part to its own rank, so search() refines the rows.
+        query_parts = [_like_escape(part) for part in query_parts]
+        pattern = "%" + "%;%".join(query_parts) + "%"
+        return func.lower(models.Sample.taxonomy).like(pattern, escape="\\")
 
 
 class AbundanceFilterStrategy(SearchStrategy):
     # Filter samples by abundance threshold
     
+    name = "abundance"
+    exact_in_sql = True
+    
     def __init__(self, min_abundance: float = 0.0, max_abundance: float = 100.0):
         self.min_abundance = min_abundance
         self.max_abundance = max_abundance
     
+    def matches(self, prepared: str, taxonomy: str) -> bool:
+        return prepared in normalize_taxonomy(taxonomy)[0]
+    
     def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
         filtered = [s for s in samples 
                    if self.min_abundance <= s.abundance <= self.max_abundance]
         
         if query:
-            query_lower = query.lower()
-            filtered = [s for s in filtered if query_lower in s.taxonomy.lower()]
+            filtered = super().search(query, filtered)
         
         return filtered
+    
+    def sql_filter(self, query: str):
+        clause = models.Sample.abundance.between(self.min_abundance, self.max_abundance)
+        if query:
+            clause = clause & _lineage_matches(
+                models.Lineage.taxonomy_lower.contains(query.lower(), autoescape=True))
+        return clause
+    
+    def column_mask(self, query: str, snapshot):
+        mask = snapshot.abundance_mask(self.min_abundance, self.max_abundance)
+        if query:
+            mask &= super().column_mask(query, snapshot)
+        return mask
+
+
+class FullTextStrategy(SearchStrategy):
+    # Token and prefix search over name, taxonomy and location through the
+    # SQLite FTS5 index, best BM25 matches first
+    
+    name = "fulltext"
+    exact_in_sql = True
+    ranked = True
+    
+    def prepare(self, query: str):
+        return fulltext.parse_query(query)
+    
+    def _all_terms_in(self, terms: List[str], words: List[str]) -> bool:
+        return bool(terms) and all(
+            any(word.startswith(term[:-1]) if term.endswith("*") else word == term for word in words)
+            for term in terms)
+    
+    def matches(self, prepared: List[str], taxonomy: str) -> bool:
+        return self._all_terms_in(prepared, fulltext.tokens(taxonomy))
+    
+    def search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
+        # Without the index: the same term rules over all three fields, unranked
+        terms = self.prepare(query)
+        return [s for s in samples if self._all_terms_in(terms, fulltext.tokens(
+            " ".join(str(getattr(s, field) or "") for field in fulltext.COLUMNS)))]
+    
+    def _match(self, query: str):
+        expression = fulltext.match_expression(query)
+        if expression is None:
+            return None
+        return fulltext.samples_fts.c.samples_fts.match(expression)
+    
+    def sql_filter(self, query: str):
+        match = self._match(query)
+        if match is None:
+            return false()
+        return models.Sample.id.in_(select(fulltext.samples_fts.c.rowid).where(match))
+    
+    def sql_order(self, query: str):
+        match = self._match(query)
+        if match is None:
+            return None
+        # BM25 score of each row for the query; FTS5 seeks it by rowid
+        return select(fulltext.samples_fts.c.rank).where(
+            match, fulltext.samples_fts.c.rowid == models.Sample.id).scalar_subquery()
 
 
 class SearchContext:
@@ -83,4 +286,112 @@ class SearchContext:
         self._strategy = strategy
     
     def execute_search(self, query: str, samples: List[models.Sample]) -> List[models.Sample]:
-        return self._strategy.search(query, samples)
\ No newline at end of file
+        return self._strategy.search(query, samples)
+    
+    def filter_query(self, query: str, sample_query, limit: Optional[int] = None):
+        # Push the strategy's predicate into a Query or select() statement
+        clause = self._strategy.sql_filter(query)
+        if clause is not None:
+            sample_query = sample_query.filter(clause)
+        order = self._strategy.sql_order(query)
+        if order is not None:
+            sample_query = sample_query.order_by(order, models.Sample.id)
+        if self._strategy.exact_in_sql and limit is not None:
+            sample_query = sample_query.limit(limit)
+        return sample_query
+    
+    def refine(self, query: str, samples: List[models.Sample], limit: Optional[int] = None) -> List[models.Sample]:
+        # Python pass over the fetched rows, only for strategies SQL can't decide
+        if not self._strategy.exact_in_sql:
+            samples = self._strategy.search(query, samples)
+        return samples if limit is None else samples[:limit]
+    
+    def execute_query(self, query: str, sample_query, limit: Optional[int] = None) -> List[models.Sample]:
+        # Push the strategy's predicate into SQL, then refine in Python only if needed
+        sample_query = self.filter_query(query, sample_query, limit)
+        return self.refine(query, sample_query.all(), limit)
+    
+    async def execute_query_async(self, query: str, db, statement, limit: Optional[int] = None,
+                                  executor: Optional[Executor] = None) -> List[models.Sample]:
+        # execute_query() for an AsyncSession and a select() statement. CPU-bound
+        # steps run in `executor` so they don't stall the event loop.
+        loop = asyncio.get_running_loop()
+        name = self._strategy.name
+        with metrics.timed(name, "filter"):
+            if self._strategy.cpu_heavy:
+                statement = await loop.run_in_executor(executor, self.filter_query, query, statement, limit)
+            else:
+                statement = self.filter_query(query, statement, limit)
+        with metrics.timed(name, "fetch"):
+            samples = (await db.scalars(statement)).all()
+        metrics.SEARCH_ROWS_SCANNED.inc(len(samples), strategy=name)
+        if not self._strategy.exact_in_sql:
+            with metrics.timed(name, "refine"):
+                samples = await loop.run_in_executor(executor, self.refine, query, samples, limit)
+        metrics.SEARCH_ROWS_RETURNED.inc(len(samples), strategy=name)
+        return samples
+    
+    def snapshot_ids(self, query: str, snapshot, after: Optional[int] = None,
+                     limit: Optional[int] = None) -> List[int]:
+        # Ids of the matching samples, decided on the columnar snapshot's arrays
+        return snapshot.select(lambda: self._strategy.column_mask(query, snapshot), after, limit)
+    
+    async def execute_snapshot_async(self, query: str, db, snapshot, after: Optional[int] = None,
+                                     limit: Optional[int] = None,
+                                     executor: Optional[Executor] = None) -> List[models.Sample]:
+        # Filter on the snapshot in `executor`, then fetch only the matching rows by id
+        loop = asyncio.get_running_loop()
+        name = self._strategy.name
+        with metrics.timed(name, "filter"):
+            sample_ids = await loop.run_in_executor(executor, self.snapshot_ids, query, snapshot, after, limit)
+        metrics.SEARCH_ROWS_SCANNED.inc(len(snapshot), strategy=name)
+        return await self._fetch_ids(db, sample_ids)
+    
+    async def execute_sharded_async(self, query: str, db, shards, after: Optional[int] = None,
+                                    limit: Optional[int] = None,
+                                    executor: Optional[Executor] = None) -> List[models.Sample]:
+        # Run the strategy on every shard of a ShardedSearch at once (waiting on the
+        # worker processes from `executor`), then fetch the merged matches by id
+        loop = asyncio.get_running_loop()
+        name = self._strategy.name
+        with metrics.timed(name, "filter"):
+            sample_ids = await loop.run_in_executor(executor, shards.search_ids, self._strategy, query, after, limit)
+        metrics.SEARCH_ROWS_SCANNED.inc(len(shards), strategy=name)
+        return await self._fetch_ids(db, sample_ids)
+    
+    async def _fetch_ids(self, db, sample_ids: List[int]) -> List[models.Sample]:
+        # Rows of the given ids, in that order (id order unless ranked)
+        name = self._strategy.name
+        if not sample_ids:
+            return []
+        with metrics.timed(name, "fetch"):
+            statement = select(models.Sample).where(models.Sample.id.in_(
+                bindparam("sample_ids", sample_ids, expanding=True, literal_execute=True)))
+            samples = (await db.scalars(statement.order_by(models.Sample.id))).all()
+        if self._strategy.ranked:
+            position = {sample_id: i for i, sample_id in enumerate(sample_ids)}
+            samples = sorted(samples, key=lambda s: position[s.id])
+        metrics.SEARCH_ROWS_RETURNED.inc(len(samples), strategy=name)
+        return samples
+    
+    def stream_query(self, query: str, sample_query, batch_size: int = 1000) -> Iterator[models.Sample]:
+        # Like execute_query(), but yields matches while rows are read from a
+        # server-side cursor, refining them one batch at a time
+        rows = self.filter_query(query, sample_query).yield_per(batch_size)
+        if self._strategy.exact_in_sql:
+            yield from rows
+        elif self._strategy.ranked:
+            yield from self._strategy.search(query, list(rows))
+        else:
+            for batch in batched(rows, batch_size):
+                yield from self._strategy.search(query, batch)
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    # Consecutive lists of up to `size` rows
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
\ No newline at end of file
@@ -0,0 +1,28 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# The app reads its settings at import time, so point it at a scratch
+# database before anything from the package is imported
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='microbiome-tests-'), 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+_usernames = (f"user{n}" for n in itertools.count())
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app import api
+    return TestClient(api.app)
+
+
+@pytest.fixture
+def user(client):
+    """A new user's id and the Authorization header of a session for them"""
+    credentials = {"username": next(_usernames), "password": "pw"}
+    user_id = client.post("/users/", json=credentials).json()["id"]
+    token = client.post("/login", json=credentials).json()["token"]
+    return user_id, {"Authorization": f"Bearer {token}"}
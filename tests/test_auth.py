@@ -0,0 +1,61 @@
+import hashlib
+import hmac
+import os
+import subprocess
+import sys
+
+from app import auth
+
+SAMPLE = {"name": "a", "taxonomy": "Bacteria;Bacillota", "abundance": 1.0, "location": "Gut"}
+
+
+def _post(client, token):
+    return client.post("/samples/", headers={"Authorization": f"Bearer {token}"}, json=SAMPLE)
+
+
+def test_forged_tokens_are_rejected(client, user):
+    user_id, headers = user
+    token = headers["Authorization"].split()[1]
+    assert _post(client, token).status_code == 200
+
+    _, expires, signature = token.split(".")
+    payload = f"{user_id}.{expires}"
+    forged = [
+        f"{user_id + 1}.{expires}.{signature}",  # Someone else's id
+        f"{user_id}.{int(expires) + 3600}.{signature}",  # Later expiry
+        f"{payload}.{'0' * len(signature)}",
+        f"{payload}.{hmac.new(b'another key', payload.encode(), hashlib.sha256).hexdigest()}",
+        payload,
+    ]
+    for forgery in forged:
+        response = _post(client, forgery)
+        assert response.status_code == 401
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_expired_tokens_are_rejected(client, user, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(auth, "SESSION_TTL", -1)
+    token = auth.issue_token(user_id)
+    assert auth.verify_token(token) is None
+    assert _post(client, token).status_code == 401
+
+
+def test_bare_user_id_needs_opting_in(client, user, monkeypatch):
+    user_id, _ = user
+    monkeypatch.setattr(auth, "ALLOW_USER_ID_AUTH", False)
+    response = client.post("/samples/", params={"user_id": user_id}, json=SAMPLE)
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+    monkeypatch.setattr(auth, "ALLOW_USER_ID_AUTH", True)
+    assert client.post("/samples/", params={"user_id": user_id}, json=SAMPLE).status_code == 200
+
+
+def test_several_workers_need_a_session_secret():
+    env = {key: value for key, value in os.environ.items() if key != "SESSION_SECRET"}
+    env.update(WEB_CONCURRENCY="2", PYTHONPATH=os.pathsep.join(sys.path))
+    command = [sys.executable, "-c", "import app.auth"]
+    refused = subprocess.run(command, env=env, capture_output=True, text=True)
+    assert refused.returncode != 0 and "SESSION_SECRET" in refused.stderr
+    assert subprocess.run(command, env=dict(env, SESSION_SECRET="shared")).returncode == 0
\ No newline at end of file
@@ -0,0 +1,15 @@
+import random
+
+from app.batch import AhoCorasick
+
+
+def test_aho_corasick_finds_what_substring_search_finds():
+    rng = random.Random(0)
+    words = ["", "a", "ab", "ba", "abab", "bacteria", "bac", "teri", ";", "a;b"]
+    for _ in range(200):
+        patterns = rng.sample(words, rng.randint(1, len(words))) + [
+            "".join(rng.choice("ab;") for _ in range(rng.randint(0, 4))) for _ in range(rng.randint(0, 6))]
+        automaton = AhoCorasick(patterns)
+        for _ in range(10):
+            text = "".join(rng.choice("abcterti;") for _ in range(rng.randint(0, 30)))
+            assert automaton.find(text) == {i for i, pattern in enumerate(patterns) if pattern in text}
\ No newline at end of file
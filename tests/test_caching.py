@@ -0,0 +1,41 @@
+def _sample(name: str):
+    return {"name": name, "taxonomy": "Bacteria;Firmicutes", "abundance": 1.0, "location": "Gut"}
+
+
+def test_matching_etag_gets_304(client, user):
+    user_id, headers = user
+    client.post("/samples/", headers=headers, json=_sample("a"))
+    response = client.get(f"/samples/user/{user_id}")
+    etag = response.headers["etag"]
+    assert response.status_code == 200 and etag.startswith('W/"')
+
+    for tag in (etag, etag.removeprefix("W/"), f'"other", {etag}', "*"):
+        cached = client.get(f"/samples/user/{user_id}", headers={"If-None-Match": tag})
+        assert cached.status_code == 304 and cached.headers["etag"] == etag and not cached.content
+    assert client.get(f"/samples/user/{user_id}", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_etag_changes_after_a_write(client, user):
+    user_id, headers = user
+    other_id = client.post("/users/", json={"username": f"other{user_id}", "password": "pw"}).json()["id"]
+    before = client.get(f"/samples/user/{user_id}").headers["etag"]
+    everything = client.get("/samples/").headers["etag"]
+    client.post("/samples/", headers=headers, json=_sample("b"))
+    after = client.get(f"/samples/user/{user_id}", headers={"If-None-Match": before})
+    assert after.status_code == 200 and after.headers["etag"] != before
+    assert client.get("/samples/", headers={"If-None-Match": everything}).status_code == 200
+    # Another user's samples didn't change, so their tag still holds
+    other = client.get(f"/samples/user/{other_id}").headers["etag"]
+    client.post("/samples/", headers=headers, json=_sample("c"))
+    assert client.get(f"/samples/user/{other_id}", headers={"If-None-Match": other}).status_code == 304
+
+
+def test_encodings_share_a_weak_etag(client, user):
+    user_id, headers = user
+    for i in range(40):  # Enough to pass the gzip threshold
+        client.post("/samples/", headers=headers, json=_sample(f"sample{i}"))
+    gzipped = client.get(f"/samples/user/{user_id}", headers={"Accept-Encoding": "gzip"})
+    identity = client.get(f"/samples/user/{user_id}", headers={"Accept-Encoding": "identity"})
+    assert gzipped.headers["content-encoding"] == "gzip" and "content-encoding" not in identity.headers
+    assert gzipped.headers["etag"] == identity.headers["etag"]
+    assert gzipped.headers["etag"].startswith('W/"')
@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+from app import api, diversity, models
+from app.database import SessionLocal
+
+TAXONOMIES = ["Bacteria;Firmicutes", "Bacteria;Proteobacteria", "Archaea;Euryarchaeota"]
+
+
+def _summaries():
+    with SessionLocal() as db:
+        return {(row.kind, row.value): (row.samples, row.richness, pytest.approx(row.total_abundance),
+                                        pytest.approx(row.sum_a_log_a), pytest.approx(row.sum_a_squared))
+                for row in db.scalars(select(models.GroupDiversity))}
+
+
+def _rebuilt():
+    with SessionLocal() as db:
+        diversity.rebuild_alpha(db)
+    return _summaries()
+
+
+def _sample(i: int, location: str):
+    return {"name": f"s{i % 3}", "taxonomy": TAXONOMIES[i % len(TAXONOMIES)],
+            "abundance": 1.5 + i % 7, "location": location}
+
+
+def test_writes_keep_summaries_current(client, user):
+    user_id, headers = user
+    ids = [client.post("/samples/", headers=headers, json=_sample(i, "Gut")).json()["id"] for i in range(9)]
+    for sample_id in ids[::2]:
+        assert client.delete(f"/samples/{sample_id}", headers=headers).status_code == 200
+    table = "name\ttaxonomy\tabundance\tlocation\n" + "".join(
+        f"b{i}\t{TAXONOMIES[i % 3]}\t{i + 0.5}\tSoil\n" for i in range(10))
+    response = client.post("/samples/bulk", headers=headers, files={"file": ("table.tsv", table)})
+    assert response.json()["inserted"] == 10
+    maintained = _summaries()
+    assert maintained[("user_id", str(user_id))][0] == 14
+    assert maintained == _rebuilt()
+
+
+def test_concurrent_writes_keep_summaries_current(user):
+    _, headers = user
+
+    async def post_all():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/samples/", headers=headers, json=_sample(i, "Lake"))
+                                          for i in range(40)))
+
+    assert all(response.status_code == 200 for response in asyncio.run(post_all()))
+    maintained = _summaries()
+    assert maintained[("location", "Lake")][0] == 40
+    assert maintained == _rebuilt()
+
+
+
+def test_chunked_distances_match_naive(monkeypatch):
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(0)
+    dense = np.where(rng.random((12, 40)) < 0.3, rng.random((12, 40)), 0.0)
+    indptr, indices, data = [0], [], []
+    for row in dense:
+        (columns,) = np.nonzero(row)
+        indices.extend(columns)
+        data.extend(row[columns])
+        indptr.append(len(indices))
+    matrix = diversity.AbundanceMatrix([str(i) for i in range(len(dense))], np.array(indptr),
+                                       np.array(indices, dtype=np.int64), np.array(data))
+    sums = dense.sum(axis=1)
+    minima = np.minimum(dense[:, None, :], dense[None, :, :]).sum(axis=2)
+    present = (dense > 0).astype(float)
+    both = present @ present.T
+    either = present.sum(axis=1)[:, None] + present.sum(axis=1)[None, :] - both
+    expected = {"braycurtis": 1 - 2 * minima / (sums[:, None] + sums[None, :]),
+                "jaccard": np.where(either > 0, 1 - both / np.maximum(either, 1), 0.0)}
+    monkeypatch.setattr(diversity, "BLOCK_ELEMENTS", 30)  # Several column chunks per band
+    for metric, distances in expected.items():
+        assert np.allclose(diversity.distance_rows(matrix, metric, 3, 9), distances[3:9], atol=1e-6)
\ No newline at end of file
@@ -0,0 +1,90 @@
+import io
+import json
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app import ingest, models
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        user = models.User(username="u", hashed_password="x", salt="s")
+        session.add(user)
+        session.commit()
+        yield session
+
+
+def _load(db, data: bytes, delimiter: str = ","):
+    user_id = db.scalar(select(models.User.id))
+    return ingest.bulk_insert(db, user_id, ingest.read_delimited(io.BytesIO(data), delimiter))
+
+
+def _stored(db):
+    return db.scalar(select(func.count()).select_from(models.Sample))
+
+
+def _biom(**table):
+    base = {"rows": [{"id": "otu1", "metadata": {"taxonomy": ["Bacteria", "Firmicutes"]}}],
+            "columns": [{"id": "s1", "metadata": {"location": "Gut"}}],
+            "matrix_type": "sparse", "data": [[0, 0, 5]]}
+    base.update(table)
+    return io.BytesIO(json.dumps(base).encode())
+
+
+def test_extra_field_is_a_row_error(db):
+    result = _load(db, b"name,taxonomy,abundance,location\n"
+                       b"a,Bacteria;X,1.5,Gut,surplus\n"
+                       b"b,Bacteria;Y,2.5,Gut\n")
+    assert result["inserted"] == 1
+    assert result["failed"] == 1
+    assert result["errors"][0]["row"] == 1
+    assert _stored(db) == 1
+
+
+def test_extra_header_column_is_ignored(db):
+    result = _load(db, b"name,taxonomy,abundance,location,notes\na,Bacteria;X,1.5,Gut,hello\n")
+    assert result == {"inserted": 1, "failed": 0, "errors": []}
+
+
+def test_invalid_utf8_is_a_row_error(db):
+    result = _load(db, b"name\ttaxonomy\tabundance\tlocation\n"
+                       b"a\tBacteria;X\t1.5\tGut\n"
+                       b"b\tBacteria;\xff\t2.5\tGut\n"
+                       b"c\tBacteria;Z\t3.5\tGut\n", "\t")
+    assert result["inserted"] == 2
+    assert result["failed"] == 1
+    assert result["errors"][0] == {"row": 2, "error": "taxonomy: not valid UTF-8"}
+    assert _stored(db) == 2
+
+
+def test_biom_rows_must_be_objects():
+    with pytest.raises(ValueError):
+        ingest.read_biom(_biom(rows=["otu1"]))
+
+
+def test_biom_metadata_must_be_an_object():
+    with pytest.raises(ValueError):
+        ingest.read_biom(_biom(columns=[{"id": "s1", "metadata": "Gut"}]))
+
+
+def test_biom_zero_total_column_is_rejected():
+    with pytest.raises(ValueError):
+        ingest.read_biom(_biom(data=[[0, 0, 5], [0, 0, -5]]))
+
+
+def test_biom_invalid_utf8_is_rejected():
+    with pytest.raises(ValueError):
+        ingest.read_biom(io.BytesIO(b'{"rows": [{"id": "\xff"}], "columns": [], "data": []}'))
+
+
+def test_biom_rows_become_samples(db):
+    rows = list(ingest.read_biom(_biom()))
+    assert rows == [(1, {"name": "s1", "taxonomy": "Bacteria;Firmicutes", "abundance": 100.0, "location": "Gut"})]
+    user_id = db.scalar(select(models.User.id))
+    assert ingest.bulk_insert(db, user_id, rows)["inserted"] == 1
\ No newline at end of file
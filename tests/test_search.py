@@ -0,0 +1,81 @@
+import pytest
+
+from app import api, lineage, models
+from app.cache import data_versions
+from app.columnar import columnar_snapshot
+from app.database import SessionLocal
+from app.shards import ShardedSearch
+
+
+def _write_elsewhere(user_id: int, taxonomy: str) -> int:
+    """Commit a sample the way another worker process would: rows and version bump, no in-memory updates"""
+    with SessionLocal() as db:
+        sample = models.Sample(name="elsewhere", taxonomy=taxonomy, abundance=2.0, location="Gut", user_id=user_id,
+                               lineage_id=lineage.lineage_ids(db, [taxonomy])[taxonomy])
+        db.add(sample)
+        data_versions.bump(db, [user_id])
+        db.commit()
+        return sample.id
+
+
+def _ids(client, **params):
+    return {sample["id"] for sample in client.get("/search", params=params).json()}
+
+
+def test_approximate_search_sees_writes_from_other_workers(client, user):
+    _, headers = user
+    query = dict(query="Bacteria;Verrucomicrobia;Opitutae", strategy="approximate", threshold=0.9)
+    first = client.post("/samples/", headers=headers, json={
+        "name": "a", "taxonomy": query["query"], "abundance": 1.0, "location": "Gut"}).json()["id"]
+    assert _ids(client, **query) == {first}
+
+    # A spelling the index has never seen, so only a rebuilt index can offer it
+    second = _write_elsewhere(user[0], "bacteria;verrucomicrobia;opitutae")
+    assert _ids(client, **query) == {first, second}
+    batch = client.post("/search/batch", json={"queries": [query]}).json()
+    assert {sample["id"] for sample in batch[query["query"]]} == {first, second}
+
+
+def test_columnar_snapshot_sees_writes_from_other_workers(client, user, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(columnar_snapshot, "enabled", True)
+    _, headers = user
+    query = dict(query="Planctomycetota;Phycisphaerae", strategy="exact")
+    first = client.post("/samples/", headers=headers, json={
+        "name": "a", "taxonomy": query["query"], "abundance": 1.0, "location": "Gut"}).json()["id"]
+    assert _ids(client, **query) == {first}
+    assert columnar_snapshot.loaded
+
+    second = _write_elsewhere(user[0], query["query"])
+    assert _ids(client, **query) == {first, second}
+
+
+def test_sharded_search_sees_writes_from_other_workers(client, user, monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(api, "sharded_search", ShardedSearch(shards=2))
+    _, headers = user
+    query = dict(query="Chloroflexota;Anaerolineae", strategy="approximate", threshold=0.9)
+    first = client.post("/samples/", headers=headers, json={
+        "name": "a", "taxonomy": query["query"], "abundance": 1.0, "location": "Gut"}).json()["id"]
+    assert _ids(client, **query) == {first}
+    assert api.sharded_search.loaded
+
+    second = _write_elsewhere(user[0], "chloroflexota;anaerolineae")
+    assert _ids(client, **query) == {first, second}
+
+
+def test_ranked_ties_are_ordered_by_id_on_every_path(client, user, monkeypatch):
+    pytest.importorskip("numpy")
+    _, headers = user
+    query = dict(query="Gemmatimonadota;Longimicrobia", strategy="approximate", threshold=0.9)
+    # Equally similar strings; the one that sorts first holds the highest id
+    ids = [client.post("/samples/", headers=headers, json={
+        "name": "a", "taxonomy": taxonomy, "abundance": 1.0, "location": "Gut"}).json()["id"]
+        for taxonomy in ["Gemmatimonadota;Longimicrobiz"] * 3 + ["Gemmatimonadota;Longimicrobib"]]
+    for limit in (1, 2, 4):
+        expected = ids[:limit]
+        assert [s["id"] for s in client.get("/search", params=dict(query, limit=limit)).json()] == expected
+        with monkeypatch.context() as patch:
+            patch.setattr(api, "sharded_search", ShardedSearch(shards=2))
+            sharded = client.get("/search", params=dict(query, limit=limit)).json()
+            assert [s["id"] for s in sharded] == expected
\ No newline at end of file
@@ -0,0 +1,36 @@
+from sqlalchemy import select
+
+from app import models
+from app.database import SessionLocal
+from app.index import TaxonomyTrie, split_taxonomy
+
+TAXONOMIES = [
+    "Bacteria;Firmicutes;Bacilli", "bacteria; firmicutes ;Clostridia", "Bacteria;Proteobacteria",
+    "Archaea", "Bacteria;;Unknown", "A;B;C;D;E;F;G;H1", "A;B;C;D;E;F;G;H2;I", "a;b;c;d;e;f;g",
+]
+
+
+def _reference(path: str):
+    # Counts the way the in-memory trie computed them; labels aren't compared,
+    # since the trie kept the first spelling seen and the table one per rank
+    trie = TaxonomyTrie()
+    with SessionLocal() as db:
+        trie.load_rows(db.execute(select(models.Sample.id, models.Sample.taxonomy)))
+    node = trie._root
+    for part in split_taxonomy(path) if path else []:
+        node = node.children.get(part)
+        if node is None:
+            return {}
+    return {key: child.count for key, child in node.children.items()}
+
+
+def test_children_match_the_trie(client, user):
+    _, headers = user
+    for i, taxonomy in enumerate(TAXONOMIES * 2):
+        client.post("/samples/", headers=headers, json={
+            "name": f"t{i}", "taxonomy": taxonomy, "abundance": 1.0, "location": "Gut"})
+    for path in ["", "bacteria", "Bacteria;Firmicutes", "BACTERIA;", "A;B;C;D;E;F", "a;b;c;d;e;f;g",
+                 "A;B;C;D;E;F;G;H2", "nothing"]:
+        children = client.get("/taxonomy/children", params={"path": path}).json()
+        assert {child["name"].lower(): child["count"] for child in children} == _reference(path), path
+        assert [child["count"] for child in children] == sorted((child["count"] for child in children), reverse=True)